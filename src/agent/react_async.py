@@ -10,9 +10,13 @@ from ..memory.vector_store import LiteVectorStore
 from ..memory.conversation_store import ConversationMemory
 from ..memory.graph_crdt import LWWGraph
 from ..memory.inbox import MemoryInbox
+from ..memory.context_manager import ContextWindow
 from ..core.user_profile import UserProfile
 from ..learning.style_adapter import StyleAdapter
 
+ROUTE_TOKENS, ANSWER_TOKENS = 220, 512
+PROMPT_MARGIN = 32  # BOS, separators and tokenizer boundary effects
+
 def _extract_first_json(text: str) -> Optional[str]:
     start = text.find("{")
     if start == -1: return None
@@ -33,6 +37,7 @@ class ReActAgent:
         self.style_adapter = style_adapter
 
     async def run(self, session_id: str, user: str, cancel: asyncio.Event) -> AsyncGenerator[str, None]:
+        self.mem.touch()  # a summarization round holding the model gives it up
         # 1. Update style model based on user input
         self.style_adapter.analyze_message(user)
         
@@ -42,9 +47,13 @@ class ReActAgent:
         
         full_system_prompt = f"{self.system_prompt} {profile_prompt} {style_prompt}".strip()
         
-        scratch = self.mem.get_recent_context(session_id)
+        # History and observations live in a window budgeted against this model's real n_ctx
+        count = self.llm.token_counter
+        window = ContextWindow(self.llm.n_ctx, count, summary=self.mem.get_summary(session_id)[0])
+        for u, a in self.mem.pairs_since_summary(session_id):
+            window.add_message("user", u); window.add_message("assistant", a)
         rag = await asyncio.get_event_loop().run_in_executor(None, self.kb.retrieve_context, user, 3)
-        facts = self.graph.facts_for_prompt(8)
+        facts = self.graph.facts_for_query(user, 8)
         if facts: rag = (rag + "\n\nPersonal facts:\n" + facts).strip()
         observations = []
 
@@ -52,8 +61,11 @@ class ReActAgent:
             if cancel.is_set():
                 yield "\n[Stopped by user]\n"; return
 
-            step_prompt = react_step_prompt(full_system_prompt, self.tools.list_tools(), scratch, user)
-            route_text = await self.llm.generate_async(step_prompt, 220, 0.1, 0.9, 40, 1.1)
+            self._fit(window, react_step_prompt(full_system_prompt, self.tools.list_tools(), "", user), ROUTE_TOKENS)
+            step_prompt = react_step_prompt(full_system_prompt, self.tools.list_tools(), window.get_context(), user)
+            # The first step's prompt (system, tools, then the session's history) is the prefix the
+            # session's next turn starts with, so its KV state is what gets kept for resuming
+            route_text = await self.llm.generate_async(step_prompt, ROUTE_TOKENS, 0.1, 0.9, 40, 1.1, session_id=session_id if step == 0 else None)
 
             js = _extract_first_json(route_text.strip())
             call = None
@@ -63,8 +75,8 @@ class ReActAgent:
 
             if not call or call.tool == "none":
                 full_answer = ""
-                final_prompt = final_answer_prompt(full_system_prompt, scratch, rag, "\n".join(observations), user)
-                async for tok in self.llm.stream_async(final_prompt, 512, 0.6, 0.9, 40, 1.1, cancel_event=cancel):
+                final_prompt = self._final_prompt(window, full_system_prompt, rag, observations, user)
+                async for tok in self.llm.stream_async(final_prompt, ANSWER_TOKENS, 0.6, 0.9, 40, 1.1, cancel_event=cancel):
                     full_answer += tok
                     yield tok
                 self.mem.add_message(session_id, user, full_answer, context="\n".join(observations))
@@ -76,13 +88,22 @@ class ReActAgent:
 
             obs = await self.tools.call(call.tool, call.args)
             observations.append(f"{call.tool} -> {obs[:800]}")
-            scratch += f"\nAssistant: {json.dumps(call.model_dump(exclude_none=True))}\nObservation: {obs}"
+            window.add_message("assistant", json.dumps(call.model_dump(exclude_none=True)))
+            window.add_message("observation", obs)
 
-        final_answer_text = await self.llm.generate_async(final_answer_prompt(full_system_prompt, scratch, rag, "\n".join(observations), user), 512, 0.6, 0.9, 40, 1.1)
+        final_answer_text = await self.llm.generate_async(self._final_prompt(window, full_system_prompt, rag, observations, user), ANSWER_TOKENS, 0.6, 0.9, 40, 1.1)
         yield final_answer_text
         self.mem.add_message(session_id, user, final_answer_text, context="\n".join(observations))
         await self._distill_facts(user, final_answer_text)
 
+    def _fit(self, window: ContextWindow, prompt_without_history: str, gen_tokens: int):
+        """Shrink the window to whatever n_ctx leaves after the rest of the prompt and the generation."""
+        window.set_budget(self.llm.n_ctx - gen_tokens - PROMPT_MARGIN - self.llm.token_counter(prompt_without_history))
+
+    def _final_prompt(self, window: ContextWindow, system: str, rag: str, observations: list, user: str) -> str:
+        self._fit(window, final_answer_prompt(system, "", rag, "\n".join(observations), user), ANSWER_TOKENS)
+        return final_answer_prompt(system, window.get_context(), rag, "\n".join(observations), user)
+
     async def _distill_facts(self, user: str, reply: str):
         prompt = (f"System:\nExtract up to 3 factual triples about the user from the exchange if present. Output strict JSON array of {{src,rel,dst,confidence}}. Use 'User' as src for user facts; only include confidence >= 0.8.\n\nUser: {user}\nAssistant: {reply}\n\nJSON:")
         txt = await self.llm.generate_async(prompt, 200, 0.1)
@@ -91,7 +112,6 @@ class ReActAgent:
         try:
             items = json.loads(js)
             if isinstance(items, list):
-                for it in items:
-                    if it.get("confidence", 0) >= 0.8:
-                        self.inbox.add(str(it["src"]), str(it["rel"]), str(it["dst"]), float(it["confidence"]))
+                self.inbox.add_many([(str(it["src"]), str(it["rel"]), str(it["dst"]), float(it["confidence"]))
+                                     for it in items if it.get("confidence", 0) >= 0.8])
         except Exception: pass
\ No newline at end of file
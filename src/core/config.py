@@ -1,7 +1,7 @@
 import yaml
 from pydantic import BaseModel, Field
 from pathlib import Path
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Literal
 
 class ModelConfig(BaseModel):
     name: str
@@ -25,6 +25,57 @@ class LearningConfig(BaseModel):
 
 class EmbeddingsConfig(BaseModel):
     model_name: str
+    workers: int = 1  # embedding worker processes; 0 = load the model in-process
+    threads_per_worker: int = 2
+    max_batch: int = 256  # texts coalesced from concurrent callers per worker call
+    batch_wait_ms: int = 5
+
+class VectorStoreConfig(BaseModel):
+    ann_nprobe: int = 8  # IVF lists probed per query: higher = better recall, slower
+    ann_min_docs: int = 4096  # below this corpus size retrieval is an exact scan
+    storage: Literal["memory", "mmap"] = "memory"  # "memory" (resident matrix) or "mmap" (on-disk sidecar for corpora larger than RAM)
+    quantization: Literal["none", "float16", "int8"] = "none"  # compact scan codes, top candidates rescored in float32
+    rescore_factor: int = 4  # first-pass candidates = k * rescore_factor
+    query_cache_size: int = 256  # LRU of recent query embeddings
+    retrieval_mode: Literal["dense", "hybrid"] = "dense"  # hybrid fuses FTS5 BM25 with cosine ranking (RRF)
+    lexical_candidates: int = 200  # BM25 hits considered per hybrid query
+    hybrid_prefilter: bool = False  # score embeddings only for the BM25 candidates
+    chunk_tokens: int = 128  # chunk budget in embedding-model tokens (capped at the model's max_seq_length)
+    chunk_overlap_tokens: int = 16
+    near_dup_distance: int = 6  # SimHash Hamming distance under which a chunk counts as a near-duplicate
+    compact_deleted_fraction: float = 0.2  # background compaction once this share of indexed rows is deleted (0 disables)
+
+class ConversationConfig(BaseModel):
+    ring_size: int = 64  # recent exchanges kept in memory per session
+    max_sessions: int = 256  # sessions whose ring buffers stay resident
+    flush_interval_ms: int = 250  # write-behind durability window
+    max_batch: int = 256  # rows per group commit
+    semantic_search: bool = False  # also embed exchanges so history_search can match by meaning
+    archive_after_days: int = 30  # older exchanges move to compressed archive segments (0 keeps everything hot)
+    archive_interval_min: int = 60
+    archive_segment_rows: int = 1000
+    archive_codec: Literal["zstd", "zlib"] = "zstd"  # zstd needs the optional 'zstandard' package, else zlib is used
+
+class GraphConfig(BaseModel):
+    lazy: bool = False  # serve the fact graph from SQLite through an LRU instead of loading it all into memory
+    cache_size: int = 4096  # hot relations kept in lazy mode
+
+class KVCacheConfig(BaseModel):
+    prefix_snapshots: int = 4  # KV-state snapshots of recent prompt prefixes kept per model (0 disables)
+    prefix_cache_mb: int = 256  # RAM budget for those snapshots (~0.1 MB per prompt token on 3B-7B models; larger ones are skipped)
+    block_tokens: int = 64  # prefixes are matched in blocks of this many tokens
+    min_prefix_tokens: int = 256  # shorter prompts are cheaper to re-evaluate than to snapshot
+    session_dir: str = "data/kv_sessions"  # per-session snapshots on disk, restored when a conversation resumes
+    session_disk_mb: int = 4096  # disk budget for them across all models, least recently used evicted first (0 disables)
+    session_min_growth: int = 256  # a session's snapshot is rewritten once its prompt prefix has grown by this many tokens
+
+class SummaryConfig(BaseModel):
+    enabled: bool = True  # roll older exchanges into a per-session LLM summary while idle
+    idle_seconds: int = 20  # quiet time before a summarization round may start
+    interval_sec: int = 15
+    min_new: int = 4  # exchanges that must be waiting before a round is worth a model call
+    max_tokens: int = 256  # summary length cap
+    max_prompt_tokens: int = 1024  # per-round prompt cap, keeping a round short next to a waiting turn
 
 class PathsConfig(BaseModel):
     conversation_db: str; knowledge_base_db: str; web_cache_db: str
@@ -36,6 +87,11 @@ class AppConfig(BaseModel):
     user_profile: UserProfileConfig
     learning: LearningConfig
     embeddings: EmbeddingsConfig
+    vector_store: VectorStoreConfig = Field(default_factory=VectorStoreConfig)
+    conversations: ConversationConfig = Field(default_factory=ConversationConfig)
+    summaries: SummaryConfig = Field(default_factory=SummaryConfig)
+    graph: GraphConfig = Field(default_factory=GraphConfig)
+    kv_cache: KVCacheConfig = Field(default_factory=KVCacheConfig)
     paths: PathsConfig
 
 def load_config(path: str = "config.yaml") -> AppConfig:
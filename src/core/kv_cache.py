@@ -0,0 +1,177 @@
+# src/core/kv_cache.py
+import hashlib, os, struct, threading, time
+import numpy as np
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+from llama_cpp import LlamaState
+
+def prefix_hashes(tokens: Sequence[int], block: int) -> List[bytes]:
+    """Chained hashes of every block-aligned token prefix: entry i covers tokens[:(i+1)*block]."""
+    h, out = hashlib.blake2b(digest_size=16), []
+    for end in range(block, len(tokens) + 1, block):
+        h.update(array("i", tokens[end - block:end]).tobytes())
+        out.append(h.copy().digest())
+    return out
+
+def compact_state(state):
+    """Drop the saved logits. Without logits_all llama-cpp never reads them, and a restore always
+    re-decodes at least one token before sampling; one row is kept so load_state can broadcast it."""
+    state.scores = state.scores[-1:].copy()
+    return state
+
+def _name(key: str) -> str:
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=12).hexdigest()
+
+def state_bytes(state) -> int:
+    return int(state.llama_state_size) + state.scores.nbytes + state.input_ids.nbytes
+
+class PrefixCache:
+    """Small LRU of KV-state snapshots (llama-cpp `LlamaState`), found by token-prefix hash.
+
+    A snapshot is indexed under the hash of each block-aligned prefix of the prompt it was taken
+    after, so a later prompt finds the snapshot sharing its longest aligned prefix with one dict
+    lookup per block. A snapshot larger than the whole budget is refused (check `fits` before
+    taking one). Not thread-safe: the owning AsyncLocalLLM only uses it under its semaphore.
+    """
+
+    def __init__(self, max_entries: int = 4, max_bytes: int = 256 << 20):
+        self.max_entries, self.max_bytes = max_entries, max_bytes
+        self._snaps: "OrderedDict[bytes, Tuple[object, List[bytes]]]" = OrderedDict()
+        self._index: Dict[bytes, bytes] = {}
+        self.bytes = 0
+
+    def __contains__(self, key: bytes) -> bool:
+        return key in self._index
+
+    def lookup(self, hashes: List[bytes]) -> Optional[Tuple[int, object]]:
+        """(index of the longest matching prefix hash, snapshot), or None."""
+        for i in range(len(hashes) - 1, -1, -1):
+            if (top := self._index.get(hashes[i])) is not None:
+                self._snaps.move_to_end(top)
+                return i, self._snaps[top][0]
+        return None
+
+    def fits(self, nbytes: int) -> bool:
+        return nbytes <= self.max_bytes
+
+    def put(self, hashes: List[bytes], state) -> bool:
+        """Cache `state`, evicting the least recently used snapshots; False if it alone exceeds the budget."""
+        if not self.fits(state_bytes(state)):
+            return False
+        top = hashes[-1]
+        if top in self._snaps:
+            self.bytes -= state_bytes(self._snaps.pop(top)[0])
+        self._snaps[top] = (state, hashes)
+        self.bytes += state_bytes(state)
+        for h in hashes:
+            self._index[h] = top
+        while self._snaps and (len(self._snaps) > self.max_entries or self.bytes > self.max_bytes):
+            old, (old_state, old_hashes) = self._snaps.popitem(last=False)
+            self.bytes -= state_bytes(old_state)
+            for h in old_hashes:
+                if self._index.get(h) == old:
+                    del self._index[h]
+        return True
+
+class SessionSnapshots:
+    """KV-state snapshots on disk, one per (session, model), so a session resumed after a restart
+    or a long gap restores its history's KV cache instead of re-evaluating it from the first token.
+
+    Files live at `root/<model>/<session>/<prefix hash>.kv` (model and session hashed); the prefix
+    hash is the last block hash of the prompt the snapshot was taken after, so a lookup only has
+    to list the session's directory and test the names against the new prompt's prefix hashes.
+    The whole tree (all models) is kept under `max_bytes` by evicting the least recently used
+    files; restoring a snapshot bumps its mtime. Only the evaluated `input_ids` are written; `load`
+    pads them back to the model's `n_ctx`, the length llama-cpp's eval writes into.
+    """
+
+    HEADER = struct.Struct("<4sqqq")  # magic, n_tokens, seed, llama_state_size
+    MAGIC = b"KVS1"
+
+    def __init__(self, root: str, model_key: str, max_bytes: int, n_ctx: int):
+        self.root, self.max_bytes, self.n_ctx = Path(root), max_bytes, n_ctx
+        self.model_dir = self.root / _name(model_key)
+        self.model_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()  # writers run in background threads
+
+    def _dir(self, session_id: str) -> Path:
+        return self.model_dir / _name(session_id)
+
+    def lookup(self, session_id: str, hashes: List[bytes]) -> Optional[Tuple[int, Path]]:
+        """(index of the longest prefix hash of the prompt with a snapshot, its path), or None."""
+        where = {h.hex(): i for i, h in enumerate(hashes)}
+        try:
+            names = os.listdir(self._dir(session_id))
+        except FileNotFoundError:
+            return None
+        hits = [(where[n[:-3]], n) for n in names if n.endswith(".kv") and n[:-3] in where]
+        if not hits:
+            return None
+        i, name = max(hits)
+        return i, self._dir(session_id) / name
+
+    def load(self, path: Path) -> LlamaState:
+        with open(path, "rb") as f:
+            magic, n_tokens, seed, size = self.HEADER.unpack(f.read(self.HEADER.size))
+            if magic != self.MAGIC or not 0 < n_tokens <= self.n_ctx:
+                raise ValueError(f"not a KV snapshot for this context: {path}")
+            ids = np.frombuffer(f.read(4 * n_tokens), dtype=np.intc)
+            llama_state = f.read(size)
+        if len(ids) != n_tokens or len(llama_state) != size:
+            raise ValueError(f"truncated KV snapshot: {path}")
+        input_ids = np.zeros(self.n_ctx, dtype=np.intc)
+        input_ids[:n_tokens] = ids
+        os.utime(path)
+        # Logits are not stored (see compact_state); one zero cell broadcasts over the restored rows
+        return LlamaState(input_ids=input_ids, scores=np.zeros((1, 1), dtype=np.single), n_tokens=n_tokens,
+                          llama_state=llama_state, llama_state_size=size, seed=seed)
+
+    def discard(self, path: Path):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def put(self, session_id: str, top: bytes, state):
+        """Write the session's snapshot, replacing its older ones, then evict down to the budget."""
+        d = self._dir(session_id)
+        d.mkdir(parents=True, exist_ok=True)
+        path = d / f"{top.hex()}.kv"
+        tmp = d / f".{top.hex()}.{os.getpid()}.{threading.get_ident()}.tmp"
+        ids = np.ascontiguousarray(state.input_ids[:state.n_tokens], dtype=np.intc)
+        with open(tmp, "wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, state.n_tokens, state.seed, state.llama_state_size))
+            f.write(ids.tobytes())
+            f.write(state.llama_state)
+        os.replace(tmp, path)
+        for old in d.glob("*.kv"):
+            if old != path:
+                self.discard(old)
+        self.evict()
+
+    def evict(self):
+        with self._lock:
+            files, total = [], 0
+            for dirpath, _, names in os.walk(self.root):
+                for n in names:
+                    p = Path(dirpath) / n
+                    try:
+                        st = p.stat()
+                    except FileNotFoundError:
+                        continue
+                    if n.endswith(".tmp") and time.time() - st.st_mtime < 3600:
+                        continue  # possibly still being written
+                    files.append((st.st_mtime, st.st_size, p))
+                    total += st.st_size
+            files.sort()
+            for _, size, p in files:
+                if total <= self.max_bytes:
+                    break
+                self.discard(p)
+                total -= size
+                try:
+                    p.parent.rmdir()  # the session's last file
+                except OSError:
+                    pass
\ No newline at end of file
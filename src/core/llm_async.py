@@ -2,10 +2,28 @@
 import asyncio, threading
 from typing import AsyncGenerator, Optional, List
 from pathlib import Path
+import llama_cpp
 from llama_cpp import Llama
+from ..memory.context_manager import TokenCounter
+from .kv_cache import PrefixCache, SessionSnapshots, prefix_hashes, compact_state
 
 class AsyncLocalLLM:
-    def __init__(self, model_path: str, n_ctx: int, n_threads: int, n_gpu_layers: int = 0, verbose: bool = False):
+    """Serialized async access to one llama-cpp model.
+
+    Prompts that share a long prefix (the system prompt, tool list and schema of every ReAct step
+    and final answer) skip re-evaluating it: after a generation the KV state is snapshotted into a
+    small LRU keyed by the hashes of the prompt's `block_tokens`-aligned prefixes, and a later
+    prompt whose prefix is cached restores that snapshot so llama-cpp only evaluates the suffix.
+    Generations tagged with a `session_id` also keep that session's latest snapshot on disk
+    (SessionSnapshots), rewritten once the session's prompt prefix has grown by `session_min_growth`
+    tokens, so resuming a conversation whose history was only appended to since (see
+    ConversationMemory.pairs_since_summary) evaluates just the turns after the snapshot.
+    """
+
+    def __init__(self, model_path: str, n_ctx: int, n_threads: int, n_gpu_layers: int = 0, verbose: bool = False,
+                 prefix_snapshots: int = 4, prefix_cache_mb: int = 256, block_tokens: int = 64, min_prefix_tokens: int = 256,
+                 model_name: Optional[str] = None, session_dir: Optional[str] = None, session_disk_mb: int = 0, session_min_growth: int = 256,
+                 prefill_chunk: int = 128):
         mp = Path(model_path)
         if not mp.exists():
             raise FileNotFoundError(f"Model not found at {mp}")
@@ -20,9 +38,97 @@ class AsyncLocalLLM:
         # Serialize access across all calls to this instance
         self._sem = asyncio.Semaphore(1)
         self.n_ctx = n_ctx # Expose context window size
+        # Exact prompt accounting with this model's own vocabulary, memoized per text
+        self.token_counter = TokenCounter(self.count_tokens)
+        self.block_tokens, self.min_prefix_tokens = block_tokens, min_prefix_tokens
+        self._prefixes = PrefixCache(prefix_snapshots, prefix_cache_mb << 20) if prefix_snapshots > 0 else None
+        self._sessions, self.session_min_growth = None, session_min_growth
+        self.prefill_chunk = prefill_chunk
+        if session_dir and session_disk_mb > 0:
+            # Snapshots only fit the exact model file and context size they were taken with
+            st = mp.stat()
+            model_key = f"{model_name or mp.stem}|{st.st_size}|{st.st_mtime_ns}|{n_ctx}"
+            self._sessions = SessionSnapshots(session_dir, model_key, session_disk_mb << 20, self._llm.n_ctx())
+
+    @property
+    def busy(self) -> bool:
+        """A generation is running (or queued) on this model."""
+        return self._sem.locked()
+
+    def count_tokens(self, text: str) -> int:
+        return len(self._llm.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+
+    def _restore_prefix(self, prompt: str, session_id: Optional[str] = None) -> List[bytes]:
+        """Load the snapshot (in memory, else the session's on disk) sharing the longest prefix with
+        `prompt`, unless the live KV cache already holds at least as much of it. Returns the prompt's
+        prefix hashes for `_remember_prefix`."""
+        sessions = self._sessions if session_id else None
+        if self._prefixes is None and sessions is None:
+            return []
+        tokens = self._llm.tokenize(prompt.encode("utf-8"), special=True)  # as create_completion does
+        hashes = prefix_hashes(tokens, self.block_tokens)
+        best, state, path = Llama.longest_token_prefix(self._llm.input_ids[:self._llm.n_tokens].tolist(), tokens), None, None
+        if self._prefixes is not None and (hit := self._prefixes.lookup(hashes)) and (hit[0] + 1) * self.block_tokens > best:
+            best, state = (hit[0] + 1) * self.block_tokens, hit[1]
+        if sessions is not None and (hit := sessions.lookup(session_id, hashes)) and (hit[0] + 1) * self.block_tokens > best:
+            path = hit[1]
+        try:
+            if path is not None:
+                state = sessions.load(path)
+                if state.input_ids.shape != self._llm.input_ids.shape:  # eval writes past n_tokens into this array
+                    raise ValueError(f"input_ids of {state.input_ids.shape} for a context of {self._llm.input_ids.shape}")
+            if state is not None:
+                self._llm.load_state(state)
+        except Exception as e:
+            print(f"[AsyncLocalLLM] dropping unusable KV snapshot {path}: {e}")
+            self._llm.reset()  # load_state may have set input_ids before failing
+            if path is not None:
+                sessions.discard(path)
+        return hashes
+
+    def _remember_prefix(self, hashes: List[bytes], session_id: Optional[str] = None):
+        if not hashes or len(hashes) * self.block_tokens < self.min_prefix_tokens:
+            return
+        state = None
+        if self._prefixes is not None and hashes[-1] not in self._prefixes and self._prefixes.fits(self._state_size()):
+            state = compact_state(self._llm.save_state())
+            self._prefixes.put(hashes, state)
+        if session_id and self._sessions is not None:
+            # Rewrite the session's file only when its prefix grew enough (or no longer matches at all)
+            stored = self._sessions.lookup(session_id, hashes)
+            grown = len(hashes) - 1 - stored[0] if stored else len(hashes)
+            if grown <= 0 or (stored and grown * self.block_tokens < self.session_min_growth):
+                return
+            state = state or compact_state(self._llm.save_state())
+            # The copy is taken under the semaphore; the file write does not hold up the next prompt
+            threading.Thread(target=self._write_session, args=(session_id, hashes[-1], state), daemon=True).start()
+
+    def _state_size(self) -> int:
+        """Upper bound on the bytes of a compacted snapshot of the current state, without copying it."""
+        return int(llama_cpp.llama_state_get_size(self._llm._ctx.ctx)) + self._llm.input_ids.nbytes + 4 * self._llm.n_vocab()
+
+    def _prefill(self, prompt: str, cancelled) -> bool:
+        """Evaluate all but the last prompt token in `prefill_chunk`-token steps, checking `cancelled()`
+        in between, so a long prompt can be abandoned mid-evaluation. The completion call that follows
+        then finds the prompt in the KV cache and only decodes the last token. False if cancelled."""
+        tokens = self._llm.tokenize(prompt.encode("utf-8"), special=True)
+        done = Llama.longest_token_prefix(self._llm.input_ids[:self._llm.n_tokens].tolist(), tokens[:-1])
+        self._llm.n_tokens = done  # eval drops the KV cells past n_tokens
+        for i in range(done, len(tokens) - 1, self.prefill_chunk):
+            if cancelled():
+                return False
+            self._llm.eval(tokens[i:min(i + self.prefill_chunk, len(tokens) - 1)])
+        return not cancelled()
+
+    def _write_session(self, session_id: str, top: bytes, state):
+        try:
+            self._sessions.put(session_id, top, state)
+        except Exception as e:
+            print(f"[AsyncLocalLLM] saving KV snapshot for session {session_id} failed: {e}")
 
-    def _generate_blocking(self, prompt: str, max_tokens: int, temperature: float=0.6, top_p: float=0.9, top_k: int=40, repeat_penalty: float=1.1, stop: Optional[List[str]] = None) -> str:
+    def _generate_blocking(self, prompt: str, max_tokens: int, temperature: float=0.6, top_p: float=0.9, top_k: int=40, repeat_penalty: float=1.1, stop: Optional[List[str]] = None, session_id: Optional[str] = None) -> str:
         stop = stop or ["\nUser:", "\nSystem:"]
+        hashes = self._restore_prefix(prompt, session_id)
         out = self._llm(
             prompt=prompt,
             max_tokens=max_tokens,
@@ -34,6 +140,7 @@ class AsyncLocalLLM:
             echo=False,
             stream=False,
         )
+        self._remember_prefix(hashes, session_id)
         return out["choices"][0]["text"]
 
     async def generate_async(self, *args, **kwargs) -> str:
@@ -44,15 +151,20 @@ class AsyncLocalLLM:
     async def stream_async(
         self,
         prompt: str, max_tokens: int, temperature: float, top_p: float, top_k: int, repeat_penalty: float,
-        stop: Optional[List[str]] = None, cancel_event: Optional[asyncio.Event] = None
+        stop: Optional[List[str]] = None, cancel_event: Optional[asyncio.Event] = None, session_id: Optional[str] = None
     ) -> AsyncGenerator[str, None]:
         async with self._sem:
             q: asyncio.Queue = asyncio.Queue(maxsize=100)
-            stop_tokens, end_sentinel = stop or ["\nUser:", "\nSystem:"], object()
+            stop_tokens, end_sentinel, item = stop or ["\nUser:", "\nSystem:"], object(), None
             loop = asyncio.get_event_loop()
+            gone = threading.Event()  # the consumer stopped iterating
+            cancelled = lambda: gone.is_set() or bool(cancel_event and cancel_event.is_set())
 
             def producer():
                 try:
+                    hashes = self._restore_prefix(prompt, session_id)
+                    if cancel_event is not None and not self._prefill(prompt, cancelled):
+                        return
                     for chunk in self._llm(
                         prompt=prompt,
                         max_tokens=max_tokens,
@@ -64,17 +176,26 @@ class AsyncLocalLLM:
                         echo=False,
                         stream=True,
                     ):
-                        if cancel_event and cancel_event.is_set():
+                        if cancelled():
                             break
                         token = chunk["choices"][0]["text"]
                         asyncio.run_coroutine_threadsafe(q.put(token), loop)
+                    if not cancelled():
+                        self._remember_prefix(hashes, session_id)
                 finally:
                     asyncio.run_coroutine_threadsafe(q.put(end_sentinel), loop)
 
             threading.Thread(target=producer, daemon=True).start()
 
-            while True:
-                item = await q.get()
-                if item is end_sentinel or (cancel_event and cancel_event.is_set()):
-                    break
-                yield item
\ No newline at end of file
+            try:
+                while True:
+                    item = await q.get()
+                    if item is end_sentinel or cancelled():
+                        break
+                    yield item
+            finally:
+                # Hold the semaphore until the producer is done with the model (it stops at its next
+                # token or prefill chunk)
+                gone.set()
+                while item is not end_sentinel:
+                    item = await q.get()
\ No newline at end of file
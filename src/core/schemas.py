@@ -6,6 +6,7 @@ ToolName = Literal[
     "fetch_url",
     "kb_add",
     "kb_query",
+    "history_search",
     "ingest_url",
     "now",
     "calc",
@@ -2,43 +2,6 @@ import os, asyncio, uuid, base64, signal
 import sys # Added for dependency check and graceful shutdown
 from pathlib import Path
 
-from .core.config import load_config, ensure_dirs, ModelConfig
-from .core.llm_async import AsyncLocalLLM
-from .core.event_bus import EventBus
-from .core.policy import PolicyManager
-from .core.model_manager import ModelManager
-from .core.user_profile import UserProfile
-from .core.validate import validate_config # Added for config check
-from .__version__ import get_version_info # Added for versioning
-
-from .secure.crypto import load_or_create_keys, verify_key_b64, verify_key_fingerprint
-from .secure.contacts import ContactManager
-from .mesh.p2p import P2P
-from .mesh.session import SessionManager
-from .mesh.protocol_kairos import Kairos
-
-from .memory.vector_store import LiteVectorStore
-from .memory.conversation_store import ConversationMemory
-from .memory.graph_crdt import LWWGraph
-from .memory.inbox import MemoryInbox
-from .memory.context_manager import ContextWindow # For Agent
-
-from .learning.lora_trainer import LoRATrainer
-from .learning.style_adapter import StyleAdapter
-
-from .tools.registry_async import AsyncToolRegistry
-from .agent.react_async import ReActAgent
-from .services.session_exec import SessionExec
-from .services.sync import SyncService
-
-from .proactive.sentinel import Sentinel
-from .proactive.curator import Curator
-
-from .ui.gui import launch_gui
-from .ui.consent import ConsentBroker
-
-from .utils.download import download_file
-
 MODEL_THREADS = max(2, os.cpu_count() or 2)
 NEXUS_URL = os.getenv("AEGIS_NEXUS_URL", "ws://127.0.0.1:7861")
 
@@ -100,6 +63,47 @@ def install_shutdown(p2p, sentinel, curator):
             signal.signal(sig, lambda s, f: _handler())
 
 def main():
+    # App modules are imported here rather than at module level: spawned embedding workers
+    # re-import this module as __mp_main__, and should load only the embedder, not gradio/llama_cpp
+    from .core.config import load_config, ensure_dirs, ModelConfig
+    from .core.llm_async import AsyncLocalLLM
+    from .core.event_bus import EventBus
+    from .core.policy import PolicyManager
+    from .core.model_manager import ModelManager
+    from .core.user_profile import UserProfile
+    from .core.validate import validate_config # Added for config check
+    from .__version__ import get_version_info # Added for versioning
+
+    from .secure.crypto import load_or_create_keys, verify_key_b64, verify_key_fingerprint
+    from .secure.contacts import ContactManager
+    from .mesh.p2p import P2P
+    from .mesh.session import SessionManager
+    from .mesh.protocol_kairos import Kairos
+
+    from .memory.vector_store import LiteVectorStore
+    from .memory.embedder import make_embedder
+    from .memory.conversation_store import ConversationMemory
+    from .memory.graph_crdt import LWWGraph
+    from .memory.inbox import MemoryInbox
+    from .memory.context_manager import ContextWindow # For Agent
+
+    from .learning.lora_trainer import LoRATrainer
+    from .learning.style_adapter import StyleAdapter
+
+    from .tools.registry_async import AsyncToolRegistry
+    from .agent.react_async import ReActAgent
+    from .services.session_exec import SessionExec
+    from .services.sync import SyncService
+
+    from .proactive.sentinel import Sentinel
+    from .proactive.curator import Curator
+    from .memory.summarizer import RollingSummarizer
+
+    from .ui.gui import launch_gui
+    from .ui.consent import ConsentBroker
+
+    from .utils.download import download_file
+
     check_optional_dependencies()
     
     cfg = load_config()
@@ -127,7 +131,9 @@ def main():
             model_cfg.path, 
             n_ctx=model_cfg.ctx_size, 
             n_threads=MODEL_THREADS, 
-            n_gpu_layers=model_cfg.n_gpu_layers
+            n_gpu_layers=model_cfg.n_gpu_layers,
+            model_name=model_cfg.name,
+            **cfg.kv_cache.model_dump()
         )
         model_manager.register_model(model_cfg.name, llm_instance)
 
@@ -149,16 +155,13 @@ def main():
     style_adapter = StyleAdapter(storage_path="data/user_data/style_patterns.json") # Added persistence path
     lora_trainer = LoRATrainer(cfg.learning.training_output_dir)
 
-    kb = LiteVectorStore(cfg.paths.knowledge_base_db, cfg.embeddings.model_name)
-    try:
-        # Pre-warm embeddings to avoid first-lag
-        _ = kb.model.encode(["warmup"], normalize_embeddings=True)
-    except Exception:
-        pass
+    embedder = make_embedder(**cfg.embeddings.model_dump())
+    kb = LiteVectorStore(cfg.paths.knowledge_base_db, cfg.embeddings.model_name, embedder=embedder, **cfg.vector_store.model_dump())
 
-    mem = ConversationMemory(cfg.paths.conversation_db)
-    graph = LWWGraph(cfg.paths.memory_graph_db)
-    inbox = MemoryInbox(cfg.paths.inbox_db)
+    conv_cfg = cfg.conversations.model_dump()
+    mem = ConversationMemory(cfg.paths.conversation_db, embedder=embedder if conv_cfg.pop("semantic_search") else None, **conv_cfg)
+    graph = LWWGraph(cfg.paths.memory_graph_db, **cfg.graph.model_dump())
+    inbox = MemoryInbox(cfg.paths.inbox_db, graph=graph)
     # context_window = ContextWindow(model_manager.get_active().n_ctx) # Not used directly in main_gui, but available
 
     peer_id = f"agent-{uuid.uuid4().hex[:6]}"
@@ -169,6 +172,9 @@ def main():
     sentinel = Sentinel(model_manager.get_active(), bus, policy) 
     curator = Curator(model_manager.get_active(), bus, policy, graph, kb) 
     
+    summary_cfg = cfg.summaries.model_dump()
+    summarizer = RollingSummarizer(model_manager.get_active(), mem, **summary_cfg) if summary_cfg.pop("enabled") else None
+
     install_shutdown(p2p, sentinel, curator) # Updated shutdown call
 
     contacts = ContactManager(cfg.paths.contacts_db)
@@ -181,7 +187,7 @@ def main():
     kairos_protocol = Kairos(session_manager, contacts)
     sync_service = SyncService(graph, p2p)
 
-    tools = AsyncToolRegistry(kb, cfg, peer_client=p2p)
+    tools = AsyncToolRegistry(kb, cfg, peer_client=p2p, mem=mem)
     
     # Agent factory must fetch the current LLM model on demand
     def agent_factory():
@@ -215,9 +221,15 @@ def main():
         # await p2p.connect()  # Disabled for single-user mode
         # asyncio.create_task(session_manager.start_maintenance())
         pass
+        # Graph anti-entropy with peers once P2P is enabled; until then it only garbage-collects tombstones
+        stop_events.append(sync_stop := asyncio.Event())
+        asyncio.create_task(sync_service.run(sync_stop))
         if proactive_enabled:
             asyncio.create_task(sentinel.run())
             asyncio.create_task(curator.run())
+        if summarizer:
+            stop_events.append(stop := asyncio.Event())
+            asyncio.create_task(summarizer.run(stop))
 
     loop = asyncio.get_event_loop()
     loop.run_until_complete(start_background_tasks())
@@ -240,6 +252,8 @@ def main():
         new_llm = model_manager.get_active()
         sentinel.set_llm(new_llm)
         curator.set_llm(new_llm)
+        if summarizer:
+            summarizer.set_llm(new_llm)
         return f"Switched to: {name}"
 
     launch_gui(
@@ -259,4 +273,6 @@ def main():
     )
 
 if __name__ == "__main__":
+    import multiprocessing
+    multiprocessing.freeze_support()  # embedding workers are spawned processes (PyInstaller builds)
     main()
\ No newline at end of file
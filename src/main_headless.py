@@ -1,30 +1,35 @@
 # src/main_headless.py
 import os, asyncio, uuid, base64
 from pathlib import Path
-from .core.config import load_config, ensure_dirs, ModelConfig
-from .core.llm_async import AsyncLocalLLM
-from .secure.crypto import load_or_create_keys
-from .secure.contacts import ContactManager
-from .mesh.p2p import P2P
-from .mesh.session import SessionManager
-from .mesh.protocol_kairos import Kairos
-from .memory.vector_store import LiteVectorStore
-from .memory.conversation_store import ConversationMemory
-from .memory.graph_crdt import LWWGraph
-from .memory.inbox import MemoryInbox
-from .tools.registry_async import AsyncToolRegistry
-from .agent.react_async import ReActAgent
-from .services.session_exec import SessionExec
-from .services.sync import SyncService
-from .utils.download import download_file
-from .core.model_manager import ModelManager
-from .core.user_profile import UserProfile
-from .learning.style_adapter import StyleAdapter # Added for ReActAgent
 
 MODEL_THREADS = max(2, os.cpu_count() or 2)
 NEXUS_URL = os.getenv("AEGIS_NEXUS_URL", "ws://127.0.0.1:7861")
 
 async def main_async():
+    # App modules are imported here rather than at module level: spawned embedding workers
+    # re-import this module as __mp_main__, and should load only the embedder, not gradio/llama_cpp
+    from .core.config import load_config, ensure_dirs, ModelConfig
+    from .core.llm_async import AsyncLocalLLM
+    from .secure.crypto import load_or_create_keys
+    from .secure.contacts import ContactManager
+    from .mesh.p2p import P2P
+    from .mesh.session import SessionManager
+    from .mesh.protocol_kairos import Kairos
+    from .memory.vector_store import LiteVectorStore
+    from .memory.embedder import make_embedder
+    from .memory.conversation_store import ConversationMemory
+    from .memory.summarizer import RollingSummarizer
+    from .memory.graph_crdt import LWWGraph
+    from .memory.inbox import MemoryInbox
+    from .tools.registry_async import AsyncToolRegistry
+    from .agent.react_async import ReActAgent
+    from .services.session_exec import SessionExec
+    from .services.sync import SyncService
+    from .utils.download import download_file
+    from .core.model_manager import ModelManager
+    from .core.user_profile import UserProfile
+    from .learning.style_adapter import StyleAdapter # Added for ReActAgent
+
     cfg = load_config()
     ensure_dirs(cfg)
     
@@ -42,16 +47,20 @@ async def main_async():
             model_cfg.path, 
             n_ctx=model_cfg.ctx_size, 
             n_threads=MODEL_THREADS, 
-            n_gpu_layers=model_cfg.n_gpu_layers
+            n_gpu_layers=model_cfg.n_gpu_layers,
+            model_name=model_cfg.name,
+            **cfg.kv_cache.model_dump()
         )
         model_manager.register_model(model_cfg.name, llm_instance)
 
     llm = model_manager.get_active()
     
-    kb = LiteVectorStore(cfg.paths.knowledge_base_db, cfg.embeddings.model_name)
-    mem = ConversationMemory(cfg.paths.conversation_db)
-    graph = LWWGraph(cfg.paths.memory_graph_db)
-    inbox = MemoryInbox(cfg.paths.inbox_db)
+    embedder = make_embedder(**cfg.embeddings.model_dump())
+    kb = LiteVectorStore(cfg.paths.knowledge_base_db, cfg.embeddings.model_name, embedder=embedder, **cfg.vector_store.model_dump())
+    conv_cfg = cfg.conversations.model_dump()
+    mem = ConversationMemory(cfg.paths.conversation_db, embedder=embedder if conv_cfg.pop("semantic_search") else None, **conv_cfg)
+    graph = LWWGraph(cfg.paths.memory_graph_db, **cfg.graph.model_dump())
+    inbox = MemoryInbox(cfg.paths.inbox_db, graph=graph)
 
     user_profile = UserProfile(cfg.user_profile.path) # For prompt generation
     style_adapter = StyleAdapter() # For prompt generation
@@ -69,7 +78,7 @@ async def main_async():
     sessions = SessionManager(p2p, ed_sk, get_trusted_vk)
     kairos = Kairos(sessions, contacts)
     sync = SyncService(graph, p2p)
-    tools = AsyncToolRegistry(kb, cfg, peer_client=p2p)
+    tools = AsyncToolRegistry(kb, cfg, peer_client=p2p, mem=mem)
     
     agent = ReActAgent(
         llm, tools, mem, kb, graph, cfg.assistant.system_prompt, 
@@ -84,8 +93,13 @@ async def main_async():
 
     SessionExec(sessions).register_kb(kb)
 
+    summary_cfg = cfg.summaries.model_dump()
+    if summary_cfg.pop("enabled"):
+        asyncio.create_task(RollingSummarizer(llm, mem, **summary_cfg).run(asyncio.Event()))
+
     await p2p.connect()
     asyncio.create_task(sessions.start_maintenance())
+    asyncio.create_task(sync.run(asyncio.Event()))  # anti-entropy with peers as they appear, then periodically
 
     print(f"[Headless] {peer_id} online. Nexus={NEXUS_URL}. Press Ctrl+C to stop.")
     while True:
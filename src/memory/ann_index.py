@@ -0,0 +1,162 @@
+# src/memory/ann_index.py
+import math, sqlite3
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+
+def _kmeans(x: np.ndarray, k: int, iters: int = 10, seed: int = 0, block_cells: int = 1 << 24) -> np.ndarray:
+    """Spherical k-means on L2-normalized rows; returns (k, dim) unit centroids."""
+    rng = np.random.default_rng(seed)
+    x = np.asarray(x, dtype=np.float32)
+    cent = x[rng.choice(len(x), size=k, replace=False)].copy()
+    assign = np.empty(len(x), dtype=np.int64)
+    step = max(1, block_cells // k)  # keeps the (rows, k) score block bounded
+    for _ in range(iters):
+        for s in range(0, len(x), step):
+            assign[s:s+step] = np.argmax(x[s:s+step] @ cent.T, axis=1)
+        # Per-list sums in one pass: rows sorted by list, then summed segment by segment
+        counts = np.bincount(assign, minlength=k)
+        full, sums = counts > 0, np.zeros_like(cent)
+        sums[full] = np.add.reduceat(x[np.argsort(assign, kind="stable")], (np.cumsum(counts) - counts)[full], axis=0)
+        # Re-seed empty lists from random points so every list stays usable
+        empty = ~full
+        sums[empty] = x[rng.integers(len(x), size=int(empty.sum()))]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        cent = sums / np.where(norms > 0, norms, 1.0)
+    return cent.astype(np.float32)
+
+def _assign(centroids: np.ndarray, lists: Dict[int, List[int]], ids: Sequence[int], vecs, block: int = 65536) -> List[Tuple[int, int]]:
+    """Append each vector's doc id to its nearest centroid's list; returns the (doc_id, list_id) pairs."""
+    ids, rows = np.asarray(ids, dtype=np.int64), []
+    for s in range(0, len(ids), block):
+        assign = np.argmax(np.asarray(vecs[s:s+block], dtype=np.float32) @ centroids.T, axis=1)
+        for doc_id, lid in zip(ids[s:s+block].tolist(), assign.tolist()):
+            lists[lid].append(doc_id)
+            rows.append((doc_id, lid))
+    return rows
+
+class IVFIndex:
+    """Inverted-file (IVF) coarse quantizer over the docs table.
+
+    Centroids and list assignments are persisted in the same SQLite DB as the
+    docs, so the index survives restarts and is kept in sync by `add`. `nprobe`
+    trades recall for latency: more probed lists means more candidates scored.
+
+    Retraining is split so it can run beside live searches: `build` computes new centroids and
+    lists without touching the index, `save` persists them and `use` swaps them in.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, nprobe: int = 8, min_train_size: int = 4096, retrain_growth: float = 4.0):
+        self.conn, self.nprobe = conn, nprobe
+        self.min_train_size, self.retrain_growth = min_train_size, retrain_growth
+        c = self.conn.cursor()
+        c.execute("CREATE TABLE IF NOT EXISTS ivf_centroids(list_id INTEGER PRIMARY KEY, centroid BLOB)")
+        c.execute("CREATE TABLE IF NOT EXISTS ivf_lists(doc_id INTEGER PRIMARY KEY, list_id INTEGER)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_ivf_list ON ivf_lists(list_id)")
+        c.execute("CREATE TABLE IF NOT EXISTS ivf_meta(key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.commit()
+        self.lists: Dict[int, List[int]] = {}
+        self.reload()
+
+    def reload(self):
+        self.centroids = np.zeros((0, 0), dtype=np.float32)
+        self.lists, self.trained_size = {}, 0
+        self._load()
+
+    def _load(self):
+        c = self.conn.cursor()
+        c.execute("SELECT list_id, centroid FROM ivf_centroids ORDER BY list_id")
+        rows = c.fetchall()
+        if not rows:
+            return
+        self.centroids = np.stack([np.frombuffer(b, dtype=np.float32) for _, b in rows])
+        self.lists = {lid: [] for lid, _ in rows}
+        c.execute("SELECT doc_id, list_id FROM ivf_lists ORDER BY doc_id")
+        for doc_id, lid in c.fetchall():
+            self.lists[lid].append(doc_id)
+        c.execute("SELECT value FROM ivf_meta WHERE key='trained_size'")
+        self.trained_size = int(row[0]) if (row := c.fetchone()) else 0
+
+    @property
+    def trained(self) -> bool:
+        return len(self.centroids) > 0
+
+    def size(self) -> int:
+        return sum(len(v) for v in self.lists.values())
+
+    def needs_training(self, n_docs: int) -> bool:
+        if n_docs < self.min_train_size:
+            return False
+        return not self.trained or n_docs >= self.trained_size * self.retrain_growth
+
+    def train(self, ids: Sequence[int], vecs: np.ndarray):
+        """(Re)build centroids from a sample and reassign every vector. Caller commits."""
+        centroids, lists = self.build(ids, vecs)
+        self.save(centroids, lists, len(ids))
+        self.use(centroids, lists, len(ids))
+
+    def build(self, ids: Sequence[int], vecs: np.ndarray, sample_per_list: int = 64) -> Tuple[np.ndarray, Dict[int, List[int]]]:
+        """Centroids from a sample and the list of every vector, leaving the live index untouched."""
+        n = len(ids)
+        nlist = max(1, min(4096, int(4 * math.sqrt(n))))
+        rng = np.random.default_rng(0)
+        sample = vecs[np.sort(rng.choice(n, size=min(n, nlist * sample_per_list), replace=False))]
+        centroids = _kmeans(sample, min(nlist, len(sample)))
+        lists = {lid: [] for lid in range(len(centroids))}
+        _assign(centroids, lists, ids, vecs)
+        return centroids, lists
+
+    def patch(self, centroids: np.ndarray, lists: Dict[int, List[int]], drop: Sequence[int], ids: Sequence[int], vecs: np.ndarray):
+        """Bring a `build` result up to date: remove the `drop` doc ids, assign the new `ids`."""
+        if len(drop):
+            gone = set(np.asarray(drop).tolist())
+            for lid, docs in lists.items():
+                lists[lid] = [d for d in docs if d not in gone]
+        _assign(centroids, lists, ids, vecs)
+
+    def save(self, centroids: np.ndarray, lists: Dict[int, List[int]], n: int):
+        """Persist a `build` result in place of the stored index. Caller commits."""
+        c = self.conn.cursor()
+        c.execute("DELETE FROM ivf_centroids"); c.execute("DELETE FROM ivf_lists")
+        c.executemany("INSERT INTO ivf_centroids(list_id, centroid) VALUES (?,?)",
+                      [(lid, cen.tobytes()) for lid, cen in enumerate(centroids)])
+        c.executemany("INSERT INTO ivf_lists(doc_id, list_id) VALUES (?,?)", ((d, lid) for lid, docs in lists.items() for d in docs))
+        c.execute("INSERT OR REPLACE INTO ivf_meta(key, value) VALUES ('trained_size', ?)", (str(n),))
+
+    def use(self, centroids: np.ndarray, lists: Dict[int, List[int]], n: int):
+        """Swap a `build` result in. Caller keeps searches out meanwhile."""
+        self.centroids, self.lists, self.trained_size = centroids, lists, n
+
+    def add(self, ids: Sequence[int], vecs: np.ndarray):
+        """Assign new vectors to their nearest list. No-op until trained. Caller commits."""
+        if not self.trained or not len(ids):
+            return
+        rows = _assign(self.centroids, self.lists, ids, vecs)
+        self.conn.cursor().executemany("INSERT OR REPLACE INTO ivf_lists(doc_id, list_id) VALUES (?,?)", rows)
+
+    def remove(self, ids: Sequence[int], chunk: int = 900):
+        """Drop deleted docs from their lists. Caller commits."""
+        if not self.trained or not len(ids):
+            return
+        ids = [int(i) for i in ids]
+        c, gone = self.conn.cursor(), {}
+        for s in range(0, len(ids), chunk):
+            part = ids[s:s+chunk]
+            for doc_id, lid in c.execute(f"SELECT doc_id, list_id FROM ivf_lists WHERE doc_id IN ({','.join('?' * len(part))})", part):
+                gone.setdefault(lid, set()).add(doc_id)
+        for lid, docs in gone.items():
+            self.lists[lid] = [d for d in self.lists[lid] if d not in docs]
+        c.executemany("DELETE FROM ivf_lists WHERE doc_id=?", [(d,) for docs in gone.values() for d in docs])
+
+    def clear(self):
+        """Forget the trained index (the corpus shrank below min_train_size). Caller commits."""
+        c = self.conn.cursor()
+        c.execute("DELETE FROM ivf_centroids"); c.execute("DELETE FROM ivf_lists"); c.execute("DELETE FROM ivf_meta")
+        self.centroids = np.zeros((0, 0), dtype=np.float32)
+        self.lists, self.trained_size = {}, 0
+
+    def search(self, q: np.ndarray, nprobe: int | None = None) -> np.ndarray:
+        """Return candidate doc ids from the `nprobe` lists closest to `q`."""
+        nprobe = max(1, min(nprobe or self.nprobe, len(self.centroids)))
+        probe = np.argpartition(-(self.centroids @ q), nprobe - 1)[:nprobe]
+        cand = [doc_id for lid in probe.tolist() for doc_id in self.lists.get(lid, [])]
+        return np.asarray(cand, dtype=np.int64)
\ No newline at end of file
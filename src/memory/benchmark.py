@@ -0,0 +1,149 @@
+# src/memory/benchmark.py
+"""Offline retrieval benchmark for LiteVectorStore.
+
+    python -m src.memory.benchmark --sizes 10000 100000 1000000 --out bench.json
+
+Builds synthetic corpora with a stub embedder (no model download, no network), then reports
+ingest throughput, query latency percentiles, memory footprint and recall@k against an exact
+float32 scan, as JSON.
+"""
+import argparse, json, platform, shutil, sys, tempfile, time
+from pathlib import Path
+from typing import List, Optional
+import numpy as np
+from .embedding_matrix import top_k
+from .vector_store import LiteVectorStore
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+class StubEmbedder:
+    """Deterministic stand-in for the embedding model.
+
+    Texts look like "<kind> <seed> c<cluster> words..." and embed to their cluster centre plus
+    seeded noise, so the corpus has the clustered structure the IVF index is built for.
+    """
+
+    max_seq_length = 512
+
+    def __init__(self, dim: int = 384, clusters: int = 256, spread: float = 0.6, seed: int = 0):
+        centres = np.random.default_rng(seed).standard_normal((clusters, dim)).astype(np.float32)
+        self.centres = centres / np.linalg.norm(centres, axis=1, keepdims=True)
+        self.dim, self.clusters, self.spread = dim, clusters, spread
+
+    def count_tokens(self, text: str) -> int:
+        return len(text.split())
+
+    def encode(self, texts, batch_size: int = 64) -> np.ndarray:
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            kind, seed, cluster = text.split(maxsplit=3)[:3]
+            noise = np.random.default_rng((int(seed), kind == "query")).standard_normal(self.dim)
+            out[i] = self.centres[int(cluster[1:])] + self.spread * noise / np.sqrt(self.dim)
+        return out / np.linalg.norm(out, axis=1, keepdims=True)
+
+def _text(kind: str, seed: int, clusters: int, vocab: int, rng: np.random.Generator) -> str:
+    words = " ".join(f"w{w}" for w in rng.integers(vocab, size=8))
+    return f"{kind} {seed} c{seed % clusters} {words}"
+
+def _exact(store: LiteVectorStore, queries: np.ndarray, k: int, block: int = 50000) -> List[set]:
+    """Ground-truth top-k ids by scanning every float32 BLOB, one block at a time."""
+    best_ids = np.zeros((len(queries), 0), dtype=np.int64)
+    best = np.zeros((len(queries), 0), dtype=np.float32)
+    c = store.conn.execute("SELECT id, embedding FROM docs ORDER BY id")
+    while rows := c.fetchmany(block):
+        ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        vecs = np.frombuffer(b"".join(r[1] for r in rows), dtype=np.float32).reshape(len(rows), -1)
+        scores = np.hstack([best, queries @ vecs.T])
+        cand = np.hstack([best_ids, np.broadcast_to(ids, (len(queries), len(ids)))])
+        sel = np.stack([top_k(s, k) for s in scores])
+        best, best_ids = np.take_along_axis(scores, sel, 1), np.take_along_axis(cand, sel, 1)
+    return [set(r.tolist()) for r in best_ids]
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def run_one(n: int, args, workdir: Path) -> dict:
+    rng = np.random.default_rng(n)
+    embedder = StubEmbedder(args.dim, args.clusters)
+    db = workdir / f"kb_{n}.db"
+    store = LiteVectorStore(str(db), "stub", embedder=embedder, storage=args.storage, quantization=args.quantization,
+                            ann_nprobe=args.nprobe, ann_min_docs=args.ann_min_docs, retrieval_mode=args.mode)
+    t0 = time.perf_counter()
+    for s in range(0, n, args.ingest_batch):
+        store.add_documents((_text("doc", i, args.clusters, args.vocab, rng), f"bench/{i % 64}")
+                            for i in range(s, min(n, s + args.ingest_batch)))
+    ingest_s = time.perf_counter() - t0
+    stored = store.conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    texts = [_text("query", j, args.clusters, args.vocab, rng) for j in range(args.queries + args.warmup)]
+    for t in texts[:args.warmup]:
+        store.retrieve_ids(t, args.k)
+    lat, found = [], []
+    for t in texts[args.warmup:]:
+        t1 = time.perf_counter()
+        found.append(store.retrieve_ids(t, args.k))
+        lat.append((time.perf_counter() - t1) * 1000)
+    truth = _exact(store, embedder.encode(texts[args.warmup:]), args.k)
+    recall = float(np.mean([len(set(f) & t) / max(1, len(t)) for f, t in zip(found, truth)]))
+
+    m = store.matrix
+    matrix_bytes = m.vecs.nbytes + m.ids.nbytes + (m.scales.nbytes if m.scales is not None else 0)
+    files = sum(p.stat().st_size for p in workdir.glob(f"kb_{n}.db*"))
+    p50, p95, p99 = np.percentile(lat, [50, 95, 99]).tolist()
+    result = {
+        "n_vectors": stored,
+        "ingest_seconds": round(ingest_s, 3),
+        "ingest_docs_per_s": round(n / ingest_s, 1),
+        "query_ms": {"p50": round(p50, 3), "p95": round(p95, 3), "p99": round(p99, 3), "mean": round(float(np.mean(lat)), 3)},
+        f"recall@{args.k}": round(recall, 4),
+        "ivf_lists": len(store.index.centroids),
+        "memory": {"matrix_mb": round(matrix_bytes / 2**20, 1), "files_mb": round(files / 2**20, 1), "peak_rss_mb": _peak_rss_mb()},
+    }
+    store.conn.close()
+    return result
+
+def main(argv=None) -> dict:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    ap.add_argument("--dim", type=int, default=384)
+    ap.add_argument("--clusters", type=int, default=256)
+    ap.add_argument("--vocab", type=int, default=50_000)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--warmup", type=int, default=10)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--storage", choices=["memory", "mmap"], default="memory")
+    ap.add_argument("--quantization", choices=["none", "float16", "int8"], default="none")
+    ap.add_argument("--mode", choices=["dense", "hybrid"], default="dense")
+    ap.add_argument("--nprobe", type=int, default=8)
+    ap.add_argument("--ann-min-docs", type=int, default=4096)
+    ap.add_argument("--ingest-batch", type=int, default=10_000, help="documents per add_documents call")
+    ap.add_argument("--workdir", help="where the benchmark DBs go (default: a temp dir, removed afterwards)")
+    ap.add_argument("--out", help="write the JSON report here instead of stdout")
+    args = ap.parse_args(argv)
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="kb-bench-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    config = {k: v for k, v in vars(args).items() if k not in ("workdir", "out")}
+    report = {"config": config, "python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(), "results": []}
+    try:
+        for n in args.sizes:
+            report["results"].append(run_one(n, args, workdir))
+            print(f"{n}: {json.dumps(report['results'][-1])}", file=sys.stderr)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        Path(args.out).write_text(text, encoding="utf-8")
+    else:
+        print(text)
+    return report
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
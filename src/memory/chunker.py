@@ -0,0 +1,100 @@
+# src/memory/chunker.py
+import hashlib, re
+from collections import deque
+from typing import Callable, Deque, Dict, Iterator, List, Tuple
+import numpy as np
+
+_PARAGRAPH = re.compile(r"\S(?:.*?\S)?(?=\s*\n\s*\n|\s*$)", re.S)
+_SENTENCE = re.compile(r"\S.*?(?:[.!?](?=\s)|$)", re.S)
+
+def _units(text: str) -> Iterator[Tuple[str, bool]]:
+    """Yield (sentence, ends_paragraph) lazily, without splitting the whole text up front."""
+    for para in _PARAGRAPH.finditer(text):
+        sents = [s.group(0).strip() for s in _SENTENCE.finditer(para.group(0))]
+        for i, s in enumerate(sents):
+            if s:
+                yield s, i == len(sents) - 1
+
+def simhash(text: str, n: int = 3) -> int:
+    """64-bit SimHash over word n-gram shingles."""
+    words = text.lower().split()
+    shingles = [" ".join(words[i:i+n]) for i in range(max(1, len(words) - n + 1))]
+    digests = b"".join(hashlib.blake2b(sh.encode("utf-8"), digest_size=8).digest() for sh in shingles)
+    # One row of 64 bits per shingle; a fingerprint bit is set where most shingles have it set
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(len(shingles), 8), axis=1, bitorder="little")
+    return int(np.packbits(2 * bits.sum(axis=0, dtype=np.int64) > len(shingles), bitorder="little").view("<u8")[0])
+
+class NearDupFilter:
+    """Remembers SimHash fingerprints; `seen` is True when one lies within `max_distance` bits.
+
+    Fingerprints are bucketed by max_distance + 1 bit bands; by pigeonhole any near duplicate
+    shares at least one band exactly, so lookups stay O(bucket) instead of O(n). Each bucket keeps
+    only its `max_bucket` most recent fingerprints, so clustered corpora (many chunks sharing a
+    band) cannot make a long ingest quadratic; a near-duplicate of an old chunk may then get through.
+    """
+
+    def __init__(self, max_distance: int = 6, max_bucket: int = 64):
+        self.max_distance, self.max_bucket = max_distance, max_bucket
+        self._n_bands = max_distance + 1
+        self._width = 64 // self._n_bands
+        self._bands: Dict[Tuple[int, int], Deque[int]] = {}
+
+    def seen(self, text: str) -> bool:
+        fp = simhash(text)
+        # The last band absorbs the leftover high bits
+        keys = [(i, (fp >> (self._width * i)) & ((1 << (self._width if i < self._n_bands - 1 else 64 - self._width * i)) - 1))
+                for i in range(self._n_bands)]
+        near = [other for key in keys for other in self._bands.get(key, ())]
+        if near and (np.bitwise_count(np.array(near, dtype=np.uint64) ^ np.uint64(fp)) <= self.max_distance).any():
+            return True
+        for key in keys:
+            if (bucket := self._bands.get(key)) is None:
+                bucket = self._bands[key] = deque(maxlen=self.max_bucket)
+            bucket.append(fp)
+        return False
+
+class Chunker:
+    """Packs whole sentences into chunks of at most `max_tokens` embedding-model tokens.
+
+    Paragraph ends close a chunk once it is at least half full, the last `overlap_tokens`
+    worth of sentences are carried into the next chunk, and sentences longer than the budget
+    are split on word boundaries. Chunks are produced lazily.
+    """
+
+    def __init__(self, count_tokens: Callable[[str], int], max_tokens: int = 128, overlap_tokens: int = 16):
+        self.count_tokens, self.max_tokens, self.overlap_tokens = count_tokens, max(8, max_tokens), max(0, overlap_tokens)
+
+    def _pieces(self, sentence: str) -> Iterator[Tuple[str, int]]:
+        n = self.count_tokens(sentence)
+        if n <= self.max_tokens:
+            yield sentence, n; return
+        words, cur = sentence.split(), []
+        for w in words:
+            if cur and self.count_tokens(" ".join(cur + [w])) > self.max_tokens:
+                yield " ".join(cur), self.count_tokens(" ".join(cur)); cur = []
+            cur.append(w)
+        if cur:
+            yield " ".join(cur), self.count_tokens(" ".join(cur))
+
+    def chunks(self, text: str) -> Iterator[str]:
+        cur: List[Tuple[str, int]] = []
+        total = 0
+        for sentence, para_end in _units(text):
+            for piece, n in self._pieces(sentence):
+                if cur and total + n > self.max_tokens:
+                    yield " ".join(s for s, _ in cur)
+                    cur, total = self._overlap(cur, n)
+                cur.append((piece, n)); total += n
+            if para_end and total >= self.max_tokens // 2:
+                yield " ".join(s for s, _ in cur)
+                cur, total = [], 0
+        if cur:
+            yield " ".join(s for s, _ in cur)
+
+    def _overlap(self, cur: List[Tuple[str, int]], incoming: int) -> Tuple[List[Tuple[str, int]], int]:
+        keep, total = [], 0
+        for s, n in reversed(cur):
+            if total + n > self.overlap_tokens or total + n + incoming > self.max_tokens:
+                break
+            keep.insert(0, (s, n)); total += n
+        return keep, total
\ No newline at end of file
@@ -1,7 +1,8 @@
 # src/memory/context_manager.py
-from typing import List, Tuple
+from typing import Callable, List, Optional
+from collections import OrderedDict
 from dataclasses import dataclass
-import time
+import hashlib, threading, time
 
 @dataclass
 class Message:
@@ -10,59 +11,100 @@ class Message:
     tokens: int
     timestamp: float
 
+def estimate_tokens(text: str) -> int:
+    """Fallback when no tokenizer is available: rough 1.3 tokens per whitespace-separated word."""
+    return int(len(text.split()) * 1.3)
+
+class TokenCounter:
+    """Exact token counts from a model tokenizer, memoized in an LRU keyed by content hash."""
+
+    def __init__(self, count: Optional[Callable[[str], int]] = None, cache_size: int = 4096):
+        self._count, self.cache_size = count or estimate_tokens, cache_size
+        self._cache: "OrderedDict[bytes, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, text: str) -> int:
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        with self._lock:
+            if (n := self._cache.get(key)) is not None:
+                self._cache.move_to_end(key)
+                return n
+        n = self._count(text)
+        with self._lock:
+            self._cache[key] = n
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return n
+
 class ContextWindow:
-    """Smart context window management with summarization"""
-    
-    def __init__(self, max_tokens: int = 3000):
+    """Smart context window management with summarization.
+
+    Token counts come from `count_tokens` (normally the active model's TokenCounter) and the
+    running total is kept incrementally, so appends and budget changes never re-count history.
+    A precomputed `summary` of older turns (see RollingSummarizer) opens the window.
+    """
+
+    def __init__(self, max_tokens: int = 3000, count_tokens: Optional[Callable[[str], int]] = None, summary: Optional[str] = None):
         self.max_tokens = max_tokens
+        self.count_tokens = count_tokens or TokenCounter()
         self.messages: List[Message] = []
-    
+        self.total_tokens = 0
+        if summary:
+            self.add_message("summary", summary)
+
     def add_message(self, role: str, content: str):
-        # Rough token estimate (will vary by tokenizer)
-        # Assuming rough 1.3 word-to-token ratio, then split on spaces.
-        tokens = len(content.split()) * 1.3 
-        self.messages.append(Message(role, content, int(tokens), time.time()))
+        # Count the rendered line so the total matches what get_context puts in the prompt
+        tokens = self.count_tokens(self._render(role, content))
+        self.messages.append(Message(role, content, tokens, time.time()))
+        self.total_tokens += tokens
         self._maybe_compress()
-    
+
+    def set_budget(self, max_tokens: int):
+        """Re-target the window (e.g. to what is left of n_ctx after the rest of the prompt)."""
+        self.max_tokens = max(0, max_tokens)
+        self._maybe_compress()
+
     def _maybe_compress(self):
         """Compress old messages when approaching token limit"""
-        if not self.messages:
+        if not self.messages or self.total_tokens <= self.max_tokens * 0.8:
             return
-            
-        total_tokens = sum(m.tokens for m in self.messages)
-        
-        if total_tokens > self.max_tokens * 0.8:
-            # Ensure we have enough messages to summarize
-            if len(self.messages) < 7:
-                return
 
+        # Ensure we have enough messages to summarize
+        if len(self.messages) >= 7:
             recent = self.messages[-6:]
             to_summarize = self.messages[:-6]
-            
-            if to_summarize:
-                summary_text = self._create_summary(to_summarize)
-                summary_msg = Message(
-                    "system",
-                    f"[Previous conversation summary: {summary_text}]",
-                    int(len(summary_text.split()) * 1.3),  # Make consistent with token calc
-                    to_summarize[0].timestamp
-                )
-                self.messages = [summary_msg] + recent
-    
+            # A "summary" message like the opening one, so the next compression folds it in again
+            content = self._create_summary(to_summarize)
+            summary_msg = Message("summary", content, self.count_tokens(self._render("summary", content)), to_summarize[0].timestamp)
+            self.messages = ([summary_msg] if content else []) + recent
+            self.total_tokens = sum(m.tokens for m in self.messages)
+
+        # Still over the hard limit: drop the oldest messages, but the opening summary (which stands for
+        # the most history) last, then cut the one left down
+        while self.total_tokens > self.max_tokens and len(self.messages) > 1:
+            self.total_tokens -= self.messages.pop(1 if self.messages[0].role == "summary" else 0).tokens
+        if self.total_tokens > self.max_tokens:
+            m = self.messages[0]
+            m.content = m.content[:int(len(m.content) * self.max_tokens / max(1, m.tokens))]
+            m.tokens = self.count_tokens(self._render(m.role, m.content))
+            self.total_tokens = m.tokens
+
     def _create_summary(self, messages: List[Message]) -> str:
-        """Create summary of old messages (could use LLM for better results)"""
-        topics = []
+        """Fold messages being compressed out into the earlier summary, if any, plus their opening user phrases"""
+        earlier, topics = [m.content for m in messages if m.role == "summary"], []
         for m in messages:
             if m.role == "user":
                 # Extract key phrases (simple heuristic)
                 words = m.content.split()
                 if len(words) > 3:
                     topics.append(" ".join(words[:5]) + "...")
-        return f"Discussed: {'; '.join(topics[:3])}"
-    
+        # Folds of just the old summary and a reply add nothing, so the summary doesn't grow with each one
+        return " ".join(earlier + ([f"Discussed: {'; '.join(topics[:3])}"] if topics else []))
+
+    @staticmethod
+    def _render(role: str, content: str) -> str:
+        return f"{role.title()}: {content}"
+
     def get_context(self) -> str:
         """Get formatted context for prompt"""
-        return "\n\n".join([
-            f"{m.role.title()}: {m.content}"
-            for m in self.messages
-        ])
\ No newline at end of file
+        return "\n\n".join([self._render(m.role, m.content) for m in self.messages])
\ No newline at end of file
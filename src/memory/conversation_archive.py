@@ -0,0 +1,130 @@
+# src/memory/conversation_archive.py
+import json, sqlite3, threading, zlib
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COLUMNS = ("id", "session_id", "ts", "user", "assistant", "context")
+
+def _compress(data: bytes, codec: str) -> Tuple[str, bytes]:
+    if codec == "zstd" and zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=10).compress(data)
+    return "zlib", zlib.compress(data, 6)
+
+def _decompress(payload: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("archive segment is zstd-compressed but the 'zstandard' package is not installed")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    return zlib.decompress(payload)
+
+class ConversationArchive:
+    """Cold tier for old conversation rows.
+
+    Rows are moved out of `conversations` in id-ordered segments of `segment_rows`, stored as one
+    compressed JSON blob each (zstd when available, else zlib). A small per-row locator table
+    (id, segment, session, ts) and a contentless FTS5 index keep archived exchanges searchable
+    without decompressing anything; only the segments holding actual hits are inflated, through
+    a small LRU. Methods take the connection to use, so the caller decides which thread writes.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, codec: str = "zstd", segment_rows: int = 1000, cache_segments: int = 4):
+        self.codec, self.segment_rows, self.cache_segments = codec, segment_rows, cache_segments
+        c = conn.cursor()
+        c.execute("CREATE TABLE IF NOT EXISTS conv_archive(segment_id INTEGER PRIMARY KEY, first_id INTEGER, last_id INTEGER, n_rows INTEGER, codec TEXT, payload BLOB)")
+        c.execute("CREATE TABLE IF NOT EXISTS conv_archive_rows(id INTEGER PRIMARY KEY, segment_id INTEGER, session_id TEXT, ts TEXT)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_conv_archive_session ON conv_archive_rows(session_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_conv_archive_ts ON conv_archive_rows(ts)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_conv_archive_segment ON conv_archive_rows(segment_id)")
+        try:
+            c.execute("CREATE VIRTUAL TABLE IF NOT EXISTS conv_archive_fts USING fts5(user, assistant, content='')")
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False
+        conn.commit()
+        self._cache: "OrderedDict[int, Dict[int, tuple]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def archive(self, conn: sqlite3.Connection, cutoff: str) -> List[int]:
+        """Move every hot row with ts < cutoff into compressed segments; one transaction per segment. Returns the ids moved."""
+        moved = []
+        with self._lock:
+            while rows := conn.execute("SELECT id, session_id, ts, user, assistant, context FROM conversations WHERE ts < ? ORDER BY id LIMIT ?",
+                                       (cutoff, self.segment_rows)).fetchall():
+                codec, payload = _compress(json.dumps(rows).encode("utf-8"), self.codec)
+                try:
+                    seg = conn.execute("INSERT INTO conv_archive(first_id, last_id, n_rows, codec, payload) VALUES (?,?,?,?,?)",
+                                       (rows[0][0], rows[-1][0], len(rows), codec, payload)).lastrowid
+                    conn.executemany("INSERT OR REPLACE INTO conv_archive_rows(id, segment_id, session_id, ts) VALUES (?,?,?,?)",
+                                     [(r[0], seg, r[1], r[2]) for r in rows])
+                    if self.fts:
+                        conn.executemany("INSERT INTO conv_archive_fts(rowid, user, assistant) VALUES (?,?,?)", [(r[0], r[3], r[4]) for r in rows])
+                    conn.executemany("DELETE FROM conversations WHERE id=?", [(r[0],) for r in rows])
+                    conn.commit()
+                except BaseException:
+                    conn.rollback()
+                    raise
+                moved += [r[0] for r in rows]
+        return moved
+
+    def search(self, conn: sqlite3.Connection, match: str, where: str, params: list, limit: int) -> List[Tuple[int, float]]:
+        """(id, bm25 rank) of archived exchanges matching the FTS5 expression, filtered by `where` over alias c."""
+        if not self.fts:
+            return []
+        cur = conn.execute(f"SELECT c.id, f.rank FROM conv_archive_fts f JOIN conv_archive_rows c ON c.id = f.rowid "
+                           f"WHERE conv_archive_fts MATCH ? AND {where} ORDER BY f.rank LIMIT ?", [match, *params, limit])
+        return cur.fetchall()
+
+    def fetch(self, conn: sqlite3.Connection, ids: List[int]) -> Dict[int, tuple]:
+        """Full archived rows (COLUMNS order) for whichever of `ids` are archived."""
+        by_segment: Dict[int, List[int]] = {}
+        for s in range(0, len(ids), 900):
+            part = ids[s:s+900]
+            for doc_id, seg in conn.execute(f"SELECT id, segment_id FROM conv_archive_rows WHERE id IN ({','.join('?' * len(part))})", part):
+                by_segment.setdefault(seg, []).append(doc_id)
+        out = {}
+        for seg, want in by_segment.items():
+            rows = self._segment(conn, seg)
+            out.update((i, rows[i]) for i in want if i in rows)
+        return out
+
+    def _segment(self, conn: sqlite3.Connection, segment_id: int) -> Dict[int, tuple]:
+        with self._lock:
+            if (rows := self._cache.get(segment_id)) is not None:
+                self._cache.move_to_end(segment_id)
+                return rows
+        codec, payload = conn.execute("SELECT codec, payload FROM conv_archive WHERE segment_id=?", (segment_id,)).fetchone()
+        rows = {r[0]: tuple(r) for r in json.loads(_decompress(payload, codec))}
+        with self._lock:
+            self._cache[segment_id] = rows
+            while len(self._cache) > self.cache_segments:
+                self._cache.popitem(last=False)
+        return rows
+
+    def restore(self, conn: sqlite3.Connection, where: str, params: list, into_hot: bool = False) -> List[tuple]:
+        """Decompress the archived rows matching `where` (alias c). With `into_hot`, move them back into
+        `conversations` under their original ids (they age out again at the next retention pass)."""
+        ids = [r[0] for r in conn.execute(f"SELECT c.id FROM conv_archive_rows c WHERE {where} ORDER BY c.id", params)]
+        found = self.fetch(conn, ids)
+        rows = [found[i] for i in ids if i in found]
+        if not into_hot or not rows:
+            return rows
+        with self._lock:
+            try:
+                conn.executemany("INSERT OR IGNORE INTO conversations(id, session_id, ts, user, assistant, context) VALUES (?,?,?,?,?,?)", rows)
+                if self.fts:
+                    conn.executemany("INSERT INTO conv_archive_fts(conv_archive_fts, rowid, user, assistant) VALUES ('delete', ?, ?, ?)",
+                                     [(r[0], r[3], r[4]) for r in rows])
+                conn.executemany("DELETE FROM conv_archive_rows WHERE id=?", [(r[0],) for r in rows])
+                # Segments with no rows left pointing at them are dropped
+                conn.execute("DELETE FROM conv_archive WHERE segment_id NOT IN (SELECT DISTINCT segment_id FROM conv_archive_rows)")
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            self._cache.clear()
+        return rows
\ No newline at end of file
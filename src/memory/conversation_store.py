@@ -1,25 +1,368 @@
-import sqlite3
-from datetime import datetime
+import atexit, queue, sqlite3, threading, time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
 from pathlib import Path
+from typing import Deque, Dict, List, Optional, Set, Tuple
+import numpy as np
 from ..utils.db import configure_sqlite
+from .conversation_archive import COLUMNS, ConversationArchive
+from .embedding_matrix import ResidentMatrix, quantize
+from .search import fts_query, rrf
 
 class ConversationMemory:
-    def __init__(self, db_path: str):
+    """Conversation log with write-behind persistence.
+
+    Recent exchanges of the most active sessions live in per-session ring buffers, so
+    `get_recent_context` needs no I/O. `add_message` only enqueues the row; a writer thread
+    group-commits queued rows at least every `flush_interval_ms` (the durability window) or
+    once `max_batch` rows are waiting. `flush()` blocks until everything queued is on disk
+    and runs automatically at interpreter exit.
+
+    `search` ranks past exchanges with an FTS5 index over user/assistant text. With an
+    `embedder`, the writer also embeds committed exchanges incrementally (backfilling older
+    ones while idle) and search fuses BM25 with cosine similarity.
+
+    Exchanges older than `archive_after_days` are moved by the writer thread (every
+    `archive_interval_min`) into compressed segments (see conversation_archive.py); search
+    covers them too and `restore` brings them back.
+
+    Each session can also carry a rolling summary of its older exchanges (`conv_summaries`),
+    written in the background by RollingSummarizer and read from a cache by `get_summary`.
+    """
+
+    def __init__(self, db_path: str, ring_size: int = 64, max_sessions: int = 256, flush_interval_ms: int = 250, max_batch: int = 256,
+                 embedder=None, embed_batch: int = 256, archive_after_days: int = 30, archive_interval_min: int = 60,
+                 archive_segment_rows: int = 1000, archive_codec: str = "zstd"):
         Path(Path(db_path).parent).mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
         self.conn = sqlite3.connect(db_path, check_same_thread=False)
         configure_sqlite(self.conn)
         c = self.conn.cursor()
         c.execute("CREATE TABLE IF NOT EXISTS conversations(id INTEGER PRIMARY KEY, session_id TEXT, ts TEXT, user TEXT, assistant TEXT, context TEXT)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_conv_session ON conversations(session_id, id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_conv_ts ON conversations(ts)")
+        c.execute("CREATE TABLE IF NOT EXISTS conv_meta(key TEXT PRIMARY KEY, value TEXT)")
+        c.execute("CREATE TABLE IF NOT EXISTS conv_embeddings(conv_id INTEGER PRIMARY KEY, embedding BLOB)")
+        c.execute("CREATE TABLE IF NOT EXISTS conv_summaries(session_id TEXT PRIMARY KEY, summary TEXT, upto_id INTEGER, ts TEXT)")
         self.conn.commit()
+        self.fts = self._setup_fts()
+        self.archive_store = ConversationArchive(self.conn, archive_codec, archive_segment_rows)
+        self.archive_after_days, self.archive_interval = archive_after_days, archive_interval_min * 60.0
+        self._next_archive = time.monotonic() + 60.0  # first pass shortly after startup
+        self.embedder, self.embed_batch = embedder, embed_batch
+        self._matrix: Optional[ResidentMatrix] = None  # int8 copy of conv_embeddings, loaded on the first semantic search
+        self._emb_lock = threading.Lock()
+        self._embed_backlog = embedder is not None
+        self.ring_size, self.max_sessions = ring_size, max_sessions
+        self.flush_interval, self.max_batch = flush_interval_ms / 1000.0, max_batch
+        self._rings: "OrderedDict[str, Deque[Tuple[str, str]]]" = OrderedDict()
+        self._in_flight: Dict[str, int] = {}  # queued, not yet committed rows per session
+        self._unsummarized: Dict[str, int] = {}  # exchanges past the summary, per session with a loaded ring
+        self._summaries: Dict[str, Tuple[str, int]] = {}  # session -> (rolling summary, last exchange id it covers)
+        self.summary_pending: Set[str] = set()  # sessions with exchanges their summary may not cover yet
+        self.last_activity = time.monotonic()
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="conversation-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
 
     def add_message(self, session_id: str, user: str, assistant: str, context: str):
+        with self._lock:
+            self._ring(session_id).append((user, assistant))
+            self._unsummarized[session_id] += 1
+            self._in_flight[session_id] = self._in_flight.get(session_id, 0) + 1
+            self.summary_pending.add(session_id)
+            self.last_activity = time.monotonic()
+        self._queue.put((session_id, datetime.utcnow().isoformat(), user, assistant, context))
+
+    def touch(self):
+        """Record that a turn is starting, so background summarization yields the model right away."""
+        self.last_activity = time.monotonic()
+
+    def get_recent_pairs(self, session_id: str, n: int = 6) -> List[Tuple[str, str]]:
+        """Last n (user, assistant) exchanges of the session, oldest first."""
+        if n > self.ring_size:
+            self.flush()
+            c = self.conn.cursor()
+            c.execute("SELECT user, assistant FROM conversations WHERE session_id=? ORDER BY id DESC LIMIT ?", (session_id, n))
+            return list(reversed(c.fetchall()))
+        with self._lock:
+            return list(self._ring(session_id))[-n:] if n > 0 else []
+
+    def pairs_since_summary(self, session_id: str, max_pairs: int = 16, stride: int = 8) -> List[Tuple[str, str]]:
+        """The exchanges the session's rolling summary does not cover yet, oldest first. Between summary
+        updates this only grows at the end, so each turn's prompt history is a prefix of the next one's
+        (which is what lets AsyncLocalLLM resume from a session's KV snapshot). Past `max_pairs` the
+        oldest are dropped in steps of `stride`, so without a summarizer the start still only moves
+        every `stride` turns. Served from the ring buffer and an in-memory count, like get_recent_pairs."""
+        with self._lock:
+            ring = self._ring(session_id)
+            n = self._unsummarized[session_id]
+        if n > max_pairs:
+            n -= -(-(n - max_pairs) // stride) * stride
+        if n <= len(ring):
+            return list(ring)[len(ring) - n:] if n > 0 else []
+        return self.get_recent_pairs(session_id, n)  # cap above ring_size: read from SQLite
+
+    def get_recent_context(self, session_id: str, n: int = 6) -> str:
+        return "\n\n".join([f"User: {u}\nAssistant: {a}" for u, a in self.get_recent_pairs(session_id, n)])
+
+    def get_summary(self, session_id: str) -> Tuple[str, int]:
+        """The session's precomputed rolling summary and the last exchange id it covers ("", 0 if none yet)."""
+        if (s := self._summaries.get(session_id)) is None:
+            row = self.conn.execute("SELECT summary, upto_id FROM conv_summaries WHERE session_id=?", (session_id,)).fetchone()
+            s = self._summaries[session_id] = (row[0], row[1]) if row else ("", 0)
+        return s
+
+    def set_summary(self, session_id: str, summary: str, upto_id: int):
+        """Store the session's summary, covering committed exchanges up to `upto_id`. Blocking (SQLite)."""
+        prev = self.get_summary(session_id)[1]
+        folded = self.conn.execute("SELECT COUNT(*) FROM conversations WHERE session_id=? AND id>? AND id<=?",
+                                   (session_id, prev, upto_id)).fetchone()[0]
+        self.conn.execute("INSERT OR REPLACE INTO conv_summaries(session_id, summary, upto_id, ts) VALUES (?,?,?,?)",
+                          (session_id, summary, upto_id, datetime.utcnow().isoformat()))
+        self.conn.commit()
+        with self._lock:
+            self._summaries[session_id] = (summary, upto_id)
+            if session_id in self._unsummarized:
+                self._unsummarized[session_id] = max(0, self._unsummarized[session_id] - folded)
+
+    def unsummarized(self, session_id: str, keep_recent: int, limit: int) -> List[Tuple[int, str, str]]:
+        """Up to `limit` committed (id, user, assistant) exchanges past the session's summary, oldest first,
+        leaving out the newest `keep_recent` (those still go into prompts verbatim)."""
+        upto = self.get_summary(session_id)[1]
+        with self._lock:
+            keep = max(0, keep_recent - self._in_flight.get(session_id, 0))
+        below = 2**63 - 1
+        if keep:
+            row = self.conn.execute("SELECT id FROM conversations WHERE session_id=? ORDER BY id DESC LIMIT 1 OFFSET ?",
+                                    (session_id, keep - 1)).fetchone()
+            if row is None:
+                return []
+            below = row[0]
+        return self.conn.execute("SELECT id, user, assistant FROM conversations WHERE session_id=? AND id>? AND id<? ORDER BY id LIMIT ?",
+                                 (session_id, upto, below, limit)).fetchall()
+
+    def _setup_fts(self) -> bool:
         c = self.conn.cursor()
-        c.execute("INSERT INTO conversations(session_id,ts,user,assistant,context) VALUES(?,?,?,?,?)",
-                  (session_id, datetime.utcnow().isoformat(), user, assistant, context))
+        existed = c.execute("SELECT 1 FROM sqlite_master WHERE name='conversations_fts'").fetchone()
+        try:
+            c.execute("CREATE VIRTUAL TABLE IF NOT EXISTS conversations_fts USING fts5(user, assistant, content='conversations', content_rowid='id')")
+        except sqlite3.OperationalError:
+            return False
+        c.execute("CREATE TRIGGER IF NOT EXISTS conversations_fts_ai AFTER INSERT ON conversations BEGIN "
+                  "INSERT INTO conversations_fts(rowid, user, assistant) VALUES (new.id, new.user, new.assistant); END")
+        c.execute("CREATE TRIGGER IF NOT EXISTS conversations_fts_ad AFTER DELETE ON conversations BEGIN "
+                  "INSERT INTO conversations_fts(conversations_fts, rowid, user, assistant) VALUES ('delete', old.id, old.user, old.assistant); END")
+        c.execute("CREATE TRIGGER IF NOT EXISTS conversations_fts_au AFTER UPDATE OF user, assistant ON conversations BEGIN "
+                  "INSERT INTO conversations_fts(conversations_fts, rowid, user, assistant) VALUES ('delete', old.id, old.user, old.assistant); "
+                  "INSERT INTO conversations_fts(rowid, user, assistant) VALUES (new.id, new.user, new.assistant); END")
+        if not existed:
+            c.execute("INSERT INTO conversations_fts(conversations_fts) VALUES ('rebuild')")
         self.conn.commit()
+        return True
 
-    def get_recent_context(self, session_id: str, n: int = 6) -> str:
+    def search(self, query: str, k: int = 5, session_id: Optional[str] = None, since: Optional[str] = None,
+               until: Optional[str] = None, candidates: int = 100, include_archive: bool = True) -> List[dict]:
+        """Best matching past exchanges, optionally limited to one session and/or an ISO time range."""
+        self.flush()
+        conds, params = [], []
+        if session_id:
+            conds.append("c.session_id = ?"); params.append(session_id)
+        if since:
+            conds.append("c.ts >= ?"); params.append(since)
+        if until:
+            conds.append("c.ts < ?"); params.append(until)
+        where = " AND ".join(conds) or "1"
+        cur = self.conn.cursor()
+        lexical = []
+        if match := fts_query(query):
+            hits = self.archive_store.search(self.conn, match, where, params, candidates) if include_archive else []
+            if self.fts:
+                cur.execute(f"SELECT c.id, f.rank FROM conversations_fts f JOIN conversations c ON c.id = f.rowid "
+                            f"WHERE conversations_fts MATCH ? AND {where} ORDER BY f.rank LIMIT ?", [match, *params, candidates])
+                hits += cur.fetchall()
+            # bm25 ranks from the hot and archive indexes are merged as-is (lower is better)
+            lexical = [i for i, _ in sorted(hits, key=lambda h: h[1])[:candidates]]
+        ranked = lexical[:k]
+        if self.embedder is not None:
+            ranked = rrf([lexical, self._semantic(query, candidates, where if conds else None, params)], k)
+        if not ranked:
+            return []
+        cur.execute(f"SELECT id, session_id, ts, user, assistant, context FROM conversations WHERE id IN ({','.join('?' * len(ranked))})", ranked)
+        rows = {r[0]: r for r in cur.fetchall()}
+        if include_archive and len(rows) < len(ranked):
+            rows.update(self.archive_store.fetch(self.conn, [i for i in ranked if i not in rows]))
+        return [dict(zip(COLUMNS[:5], rows[i][:5])) for i in ranked if i in rows]
+
+    def archive(self, older_than_days: Optional[int] = None, conn: Optional[sqlite3.Connection] = None) -> int:
+        """Move exchanges older than the retention threshold into compressed archive segments."""
+        days = self.archive_after_days if older_than_days is None else older_than_days
+        if conn is None:
+            self.flush()
+        conn = conn or self.conn
+        moved = self.archive_store.archive(conn, (datetime.utcnow() - timedelta(days=days)).isoformat())
+        if moved:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")  # keep the WAL from carrying the moved pages around
+            # Archived exchanges are only searched lexically; their rows in conv_embeddings stay for restore
+            with self._emb_lock:
+                if (m := self._matrix) is not None:
+                    m.mark_deleted(moved)
+                    if m.deleted_fraction > 0.25:
+                        self._matrix = None  # reloaded without them on the next search
+        return len(moved)
+
+    def restore(self, session_id: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+                into_hot: bool = False) -> List[dict]:
+        """Archived exchanges (with their tool context) for a session and/or ISO time range; see ConversationArchive.restore."""
+        conds, params = [], []
+        for cond, value in (("c.session_id = ?", session_id), ("c.ts >= ?", since), ("c.ts < ?", until)):
+            if value:
+                conds.append(cond); params.append(value)
+        rows = self.archive_store.restore(self.conn, " AND ".join(conds) or "1", params, into_hot)
+        if into_hot and rows:
+            with self._emb_lock:
+                self._matrix = None  # restored ids are older than the matrix's last row; reload to take them back in
+        return [dict(zip(COLUMNS, r)) for r in rows]
+
+    def _semantic(self, query: str, limit: int, where: Optional[str], params: list) -> List[int]:
+        """Nearest hot exchanges by embedding (archived ones are not in the matrix)."""
+        q = self.embedder.encode([query])[0]
+        ids = None
+        if where:
+            scoped = [r[0] for r in self.conn.execute(f"SELECT c.id FROM conversations c WHERE {where}", params)]
+            ids = np.sort(np.asarray(scoped, dtype=np.int64))
+        with self._emb_lock:  # the writer appends to the same matrix
+            if self._matrix is None:
+                self._matrix = self._load_matrix()
+            m = self._matrix
+            if not len(m):
+                return []
+            return m.search(q, limit, None if ids is None else m.rows_for(ids))[0].tolist()
+
+    def _load_matrix(self) -> ResidentMatrix:
+        matrix = None
+        c = self.conn.execute("SELECT conv_id, embedding FROM conv_embeddings WHERE conv_id NOT IN (SELECT id FROM conv_archive_rows) ORDER BY conv_id")
+        while rows := c.fetchmany(10000):
+            vecs = np.frombuffer(b"".join(r[1] for r in rows), dtype=np.float32).reshape(len(rows), -1)
+            if matrix is None:
+                matrix = ResidentMatrix(vecs.shape[1], codec="int8")
+            matrix.append([r[0] for r in rows], *quantize(vecs, "int8"))
+        return matrix if matrix is not None else ResidentMatrix(self.embedder.dim, codec="int8")
+
+    def _embed_pending(self, conn: sqlite3.Connection):
+        """Embed the next `embed_batch` exchanges past the high-water mark. Runs on the writer thread."""
+        row = conn.execute("SELECT value FROM conv_meta WHERE key='embedded_upto'").fetchone()
+        rows = conn.execute("SELECT id, user, assistant FROM conversations WHERE id > ? ORDER BY id LIMIT ?",
+                            (int(row[0]) if row else 0, self.embed_batch)).fetchall()
+        self._embed_backlog = len(rows) == self.embed_batch
+        if not rows:
+            return
+        embs = np.asarray(self.embedder.encode([f"User: {u}\nAssistant: {a}" for _, u, a in rows]), dtype=np.float32)
+        conn.executemany("INSERT OR REPLACE INTO conv_embeddings(conv_id, embedding) VALUES (?,?)",
+                         [(r[0], e.tobytes()) for r, e in zip(rows, embs)])
+        conn.execute("INSERT OR REPLACE INTO conv_meta(key, value) VALUES ('embedded_upto', ?)", (str(rows[-1][0]),))
+        conn.commit()
+        with self._emb_lock:
+            if (m := self._matrix) is not None:
+                # The lazy load may already have picked some of these rows up
+                keep = [i for i, r in enumerate(rows) if not len(m) or r[0] > int(m.ids[-1])]
+                if keep:
+                    m.append([rows[i][0] for i in keep], *quantize(embs[keep], "int8"))
+
+    def _ring(self, session_id: str) -> Deque[Tuple[str, str]]:
+        """The session's ring buffer, loaded from SQLite on first use. Caller holds _lock."""
+        if (ring := self._rings.get(session_id)) is not None:
+            self._rings.move_to_end(session_id)
+            return ring
         c = self.conn.cursor()
-        c.execute("SELECT user, assistant FROM conversations WHERE session_id=? ORDER BY id DESC LIMIT ?", (session_id, n))
-        pairs = reversed(c.fetchall())
-        return "\n\n".join([f"User: {u}\nAssistant: {a}" for u, a in pairs])
\ No newline at end of file
+        c.execute("SELECT user, assistant FROM conversations WHERE session_id=? ORDER BY id DESC LIMIT ?", (session_id, self.ring_size))
+        ring = self._rings[session_id] = deque(reversed(c.fetchall()), maxlen=self.ring_size)
+        # An unloaded session has nothing in flight, so the committed rows are all of them
+        self._unsummarized[session_id] = c.execute("SELECT COUNT(*) FROM conversations WHERE session_id=? AND id>?",
+                                                   (session_id, self.get_summary(session_id)[1])).fetchone()[0]
+        # Evict least recently used rings, but never one whose rows aren't committed yet:
+        # reloading it from SQLite would miss them
+        for sid in [s for s in self._rings if s not in self._in_flight and s != session_id][:max(0, len(self._rings) - self.max_sessions)]:
+            del self._rings[sid], self._unsummarized[sid]
+        return ring
+
+    def flush(self):
+        """Block until every queued message is committed."""
+        self._queue.join()
+
+    def close(self):
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    def _write_loop(self):
+        conn = sqlite3.connect(self.db_path)
+        configure_sqlite(conn)
+        stop = False
+        while not stop:
+            try:
+                item = self._queue.get(timeout=self._idle_timeout())
+            except queue.Empty:
+                self._idle_work(conn)
+                continue
+            if item is None:
+                self._queue.task_done()
+                break
+            batch, deadline = [item], time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch and (left := deadline - time.monotonic()) > 0:
+                try:
+                    item = self._queue.get(timeout=left)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.task_done(); stop = True
+                    break
+                batch.append(item)
+            try:
+                conn.executemany("INSERT INTO conversations(session_id,ts,user,assistant,context) VALUES(?,?,?,?,?)", batch)
+                conn.commit()
+            except sqlite3.Error as e:
+                conn.rollback()
+                print(f"[ConversationMemory] failed to persist {len(batch)} messages: {e}")
+            with self._lock:
+                for session_id, *_ in batch:
+                    if (left := self._in_flight[session_id] - 1):
+                        self._in_flight[session_id] = left
+                    else:
+                        del self._in_flight[session_id]
+            for _ in batch:
+                self._queue.task_done()
+            if self.embedder is not None:
+                self._embed(conn)  # the batch is already durable; embedding only delays the next one
+            if self.archive_after_days and time.monotonic() >= self._next_archive:
+                self._idle_work(conn)
+        conn.close()
+
+    def _idle_timeout(self) -> Optional[float]:
+        """How long the writer may block on an empty queue before it has background work to do."""
+        waits = []
+        if self._embed_backlog:
+            waits.append(1.0)  # older exchanges still lack embeddings: backfill while idle
+        if self.archive_after_days:
+            waits.append(max(0.0, self._next_archive - time.monotonic()))
+        return min(waits) if waits else None
+
+    def _idle_work(self, conn: sqlite3.Connection):
+        if self._embed_backlog:
+            self._embed(conn)
+        if self.archive_after_days and time.monotonic() >= self._next_archive:
+            self._next_archive = time.monotonic() + self.archive_interval
+            try:
+                self.archive(conn=conn)
+            except Exception as e:
+                print(f"[ConversationMemory] archiving old exchanges failed: {e}")
+
+    def _embed(self, conn: sqlite3.Connection):
+        try:
+            self._embed_pending(conn)
+        except Exception as e:
+            conn.rollback()
+            self._embed_backlog = False
+            print(f"[ConversationMemory] embedding exchanges failed: {e}")
\ No newline at end of file
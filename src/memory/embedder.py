@@ -0,0 +1,174 @@
+# src/memory/embedder.py
+import atexit, os, queue, threading, time
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+from typing import List, Optional, Sequence
+import numpy as np
+
+class LocalEmbedder:
+    """In-process SentenceTransformer that is only loaded on first use."""
+
+    def __init__(self, model_name: str, threads: Optional[int] = None):
+        self.model_name, self.threads = model_name, threads
+        self._model, self._lock = None, threading.Lock()
+
+    @property
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                if self.threads:
+                    import torch
+                    torch.set_num_threads(self.threads)
+                from sentence_transformers import SentenceTransformer
+                self._model = SentenceTransformer(self.model_name)
+            return self._model
+
+    @property
+    def dim(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    @property
+    def max_seq_length(self) -> int:
+        return self.model.max_seq_length
+
+    def count_tokens(self, text: str) -> int:
+        if (tok := getattr(self.model, "tokenizer", None)) is None:
+            return len(text.split())
+        return len(tok(text, add_special_tokens=False)["input_ids"])
+
+    def encode(self, texts: Sequence[str], batch_size: int = 64) -> np.ndarray:
+        """L2-normalized float32 embeddings, one row per text."""
+        return np.asarray(self.model.encode(list(texts), batch_size=batch_size, normalize_embeddings=True), dtype=np.float32)
+
+# --- worker process side -------------------------------------------------------------------
+
+_worker: Optional[LocalEmbedder] = None
+
+def _worker_init(model_name: str, threads: int):
+    global _worker
+    # Pin BLAS/OpenMP pools before torch is imported so workers don't oversubscribe llama.cpp's cores
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    _worker = LocalEmbedder(model_name, threads)
+
+def _worker_info() -> tuple:
+    return _worker.dim, _worker.max_seq_length
+
+def _worker_encode(texts: List[str], batch_size: int) -> tuple:
+    """Encode into a fresh shared-memory block; the parent copies it out and unlinks it."""
+    embs = _worker.encode(texts, batch_size)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, embs.nbytes))
+    np.ndarray(embs.shape, dtype=np.float32, buffer=shm.buf)[:] = embs
+    name = shm.name
+    shm.close()
+    return name, embs.shape
+
+# --- parent side ---------------------------------------------------------------------------
+
+class EmbeddingService:
+    """Out-of-process embedding pool shared by every caller (agent RAG, kb tools, peers).
+
+    Worker processes are spawned lazily on the first request, each with a fixed thread count.
+    Concurrent `encode` calls are coalesced by a dispatcher thread into batches of up to
+    `max_batch` texts (waiting at most `max_wait_ms` for company), and results come back
+    through shared memory instead of being pickled.
+    """
+
+    def __init__(self, model_name: str, workers: int = 1, threads_per_worker: int = 1, max_batch: int = 256, max_wait_ms: int = 5):
+        self.model_name, self.workers, self.threads = model_name, max(1, workers), max(1, threads_per_worker)
+        self.max_batch, self.max_wait = max_batch, max_wait_ms / 1000.0
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._requests: "queue.Queue[tuple]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._info: Optional[tuple] = None
+        self._tokenizer = None
+
+    def _ensure_started(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=get_context("spawn"),
+                                                 initializer=_worker_init, initargs=(self.model_name, self.threads))
+                threading.Thread(target=self._dispatch, daemon=True).start()
+                atexit.register(self.close)
+            return self._pool
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._requests.put(None)
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def _worker_info(self) -> tuple:
+        if self._info is None:
+            self._info = self._ensure_started().submit(_worker_info).result()
+        return self._info
+
+    @property
+    def dim(self) -> int:
+        return self._worker_info()[0]
+
+    @property
+    def max_seq_length(self) -> int:
+        return self._worker_info()[1]
+
+    def count_tokens(self, text: str) -> int:
+        # Only the tokenizer is loaded in this process; the model weights stay in the workers
+        if self._tokenizer is None:
+            from transformers import AutoTokenizer
+            self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        return len(self._tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def encode(self, texts: Sequence[str], batch_size: int = 64) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        self._ensure_started()
+        fut: Future = Future()
+        self._requests.put((texts, fut))
+        return fut.result()
+
+    def _dispatch(self):
+        while True:
+            first = self._requests.get()
+            if first is None:
+                return
+            pending, n = [first], len(first[0])
+            deadline = time.monotonic() + self.max_wait
+            while n < self.max_batch and (left := deadline - time.monotonic()) > 0:
+                try:
+                    item = self._requests.get(timeout=left)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._requests.put(None); break
+                pending.append(item); n += len(item[0])
+            texts = [t for req, _ in pending for t in req]
+            try:
+                job = self._pool.submit(_worker_encode, texts, 64)
+            except Exception as e:
+                for _, fut in pending: fut.set_exception(e)
+                continue
+            job.add_done_callback(lambda j, pending=pending: self._deliver(j, pending))
+
+    @staticmethod
+    def _deliver(job: Future, pending: list):
+        try:
+            name, shape = job.result()
+            shm = shared_memory.SharedMemory(name=name)
+            try:
+                embs = np.ndarray(shape, dtype=np.float32, buffer=shm.buf).copy()
+            finally:
+                shm.close(); shm.unlink()
+        except Exception as e:
+            for _, fut in pending: fut.set_exception(e)
+            return
+        start = 0
+        for texts, fut in pending:
+            fut.set_result(embs[start:start + len(texts)]); start += len(texts)
+
+def make_embedder(model_name: str, workers: int = 0, threads_per_worker: int = 1, max_batch: int = 256, batch_wait_ms: int = 5):
+    """workers > 0 runs embedding in a process pool; 0 keeps a lazily loaded in-process model."""
+    if workers <= 0:
+        return LocalEmbedder(model_name, threads_per_worker)
+    return EmbeddingService(model_name, workers, threads_per_worker, max_batch, batch_wait_ms)
\ No newline at end of file
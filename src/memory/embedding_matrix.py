@@ -0,0 +1,232 @@
+# src/memory/embedding_matrix.py
+from pathlib import Path
+from typing import Optional, Tuple
+import numpy as np
+
+CODECS = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+def quantize(vecs: np.ndarray, codec: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Encode float32 rows as `codec`; int8 uses a per-vector scale (max |x| / 127)."""
+    vecs = np.asarray(vecs, dtype=np.float32)
+    if codec != "int8":
+        return vecs.astype(CODECS[codec]), None
+    scales = np.abs(vecs).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    return np.round(vecs / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+def dequantize(codes: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+    out = np.asarray(codes).astype(np.float32, copy=False)
+    return out * np.asarray(scales, dtype=np.float32)[:, None] if scales is not None else out
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest scores, best first, without a full sort."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    part = np.argpartition(-scores, k - 1)[:k]
+    return part[np.argsort(-scores[part])]
+
+class _Decoded:
+    """Read-only float32 view over a (possibly quantized) matrix, or over a subset of its `rows`, decoded per slice."""
+    def __init__(self, m: "_Matrix", rows: Optional[np.ndarray] = None): self.m, self.rows = m, rows
+    def __len__(self) -> int: return len(self.m) if self.rows is None else len(self.rows)
+    def __getitem__(self, sel) -> np.ndarray: return self.m.decode(sel if self.rows is None else self.rows[sel])
+
+class _Matrix:
+    """Shared lookup/scoring over (N, dim) `vecs` codes, optional int8 `scales` and a parallel, increasing `ids` array."""
+    dim: int
+    n: int
+    codec: str = "float32"
+    block: Optional[int] = None  # rows scored per matmul; None scores everything at once
+    n_deleted: int = 0
+    _deleted: Optional[np.ndarray] = None  # bool per row, allocated on the first delete
+
+    def __len__(self) -> int:
+        return self.n
+
+    @property
+    def deleted_fraction(self) -> float:
+        return self.n_deleted / self.n if self.n else 0.0
+
+    def _deleted_mask(self) -> np.ndarray:
+        # Rows appended since the last delete are live; pad the mask to cover them
+        if self._deleted is None or len(self._deleted) < self.n:
+            grown = np.zeros(self.n, dtype=bool)
+            if self._deleted is not None:
+                grown[:len(self._deleted)] = self._deleted
+            self._deleted = grown
+        return self._deleted[:self.n]
+
+    def mark_deleted(self, doc_ids) -> int:
+        """Exclude the rows of `doc_ids` from scoring; they stay in place until the matrix is rebuilt."""
+        rows, dead = self.rows_for(doc_ids), self._deleted_mask()
+        rows = rows[~dead[rows]]
+        dead[rows] = True
+        self.n_deleted += len(rows)
+        return len(rows)
+
+    def clear_deleted(self):
+        self._deleted, self.n_deleted = None, 0
+
+    @property
+    def scales(self) -> Optional[np.ndarray]:
+        return None
+
+    @property
+    def decoded(self) -> _Decoded:
+        return _Decoded(self)
+
+    def live(self) -> Tuple[np.ndarray, _Decoded]:
+        """(doc ids, decoded view) of the rows not marked deleted."""
+        if not self.n_deleted:
+            return self.ids, self.decoded
+        rows = np.flatnonzero(~self._deleted_mask())
+        return self.ids[rows], _Decoded(self, rows)
+
+    def decode(self, sel) -> np.ndarray:
+        return dequantize(self.vecs[sel], self.scales[sel] if self.scales is not None else None)
+
+    def rows_for(self, doc_ids: np.ndarray) -> np.ndarray:
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        rows = np.searchsorted(self.ids, doc_ids)
+        ok = rows < self.n
+        rows = rows[ok]
+        return rows[self.ids[rows] == doc_ids[ok]]
+
+    def _dot(self, sel, q: np.ndarray) -> np.ndarray:
+        out = self.vecs[sel].astype(np.float32, copy=False) @ q
+        return out * self.scales[sel] if self.scales is not None else out
+
+    def score(self, q: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        if rows is not None:
+            return self._dot(rows, q)
+        if not self.block:
+            return self._dot(slice(None), q)
+        out = np.empty(self.n, dtype=np.float32)
+        for s in range(0, self.n, self.block):
+            out[s:s+self.block] = self._dot(slice(s, s + self.block), q)
+        return out
+
+    def search(self, q: np.ndarray, k: int, rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Score all rows (or only `rows`) against `q`; returns the top-k (doc_ids, scores)."""
+        dead = self._deleted_mask() if self.n_deleted else None
+        if rows is not None:
+            if dead is not None:
+                rows = rows[~dead[rows]]
+            if self.block:
+                rows = np.sort(rows)
+        scores = self.score(q, rows)
+        if rows is None and dead is not None:
+            scores[dead] = -np.inf
+        ids = self.ids if rows is None else self.ids[rows]
+        best = top_k(scores, k)
+        best = best[np.isfinite(scores[best])]
+        return ids[best], scores[best]
+
+class ResidentMatrix(_Matrix):
+    """Contiguous in-memory (N, dim) embedding matrix with a parallel row -> doc id array.
+
+    Doc ids are appended in increasing order, so id -> row lookups are a binary search.
+    Capacity grows geometrically so `append` is amortised O(rows added). Quantized codecs
+    are scored in blocks so the float32 temporaries stay small.
+    """
+
+    def __init__(self, dim: int, capacity: int = 1024, codec: str = "float32"):
+        self.dim, self.n, self.codec = dim, 0, codec
+        self.block = None if codec == "float32" else 65536
+        self._vecs = np.zeros((capacity, dim), dtype=CODECS[codec])
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._scales = np.ones(capacity, dtype=np.float32) if codec == "int8" else None
+
+    @property
+    def vecs(self) -> np.ndarray:
+        return self._vecs[:self.n]
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[:self.n]
+
+    @property
+    def scales(self) -> Optional[np.ndarray]:
+        return self._scales[:self.n] if self._scales is not None else None
+
+    def append(self, ids, codes: np.ndarray, scales: Optional[np.ndarray] = None):
+        m = len(ids)
+        if self.n + m > len(self._ids):
+            cap = max(self.n + m, 2 * len(self._ids))
+            vecs_new, ids_new = np.zeros((cap, self.dim), dtype=self._vecs.dtype), np.zeros(cap, dtype=np.int64)
+            vecs_new[:self.n], ids_new[:self.n] = self.vecs, self.ids
+            self._vecs, self._ids = vecs_new, ids_new
+            if self._scales is not None:
+                scales_new = np.ones(cap, dtype=np.float32)
+                scales_new[:self.n] = self.scales
+                self._scales = scales_new
+        self._vecs[self.n:self.n+m] = np.asarray(codes).reshape(m, self.dim)
+        self._ids[self.n:self.n+m] = ids
+        if self._scales is not None:
+            self._scales[self.n:self.n+m] = scales
+        self.n += m
+
+class MemmapMatrix(_Matrix):
+    """Append-only embedding sidecar: `<base>.emb` holds the row codes, `<base>.ids` the doc id
+    per row and, for int8, `<base>.scl` the per-row scale.
+
+    Files are mapped read-only with np.memmap and scanned in blocks, so the OS page cache
+    (not the Python heap) holds the vectors and cold pages can be dropped under pressure.
+    """
+
+    def __init__(self, base: str, dim: int, codec: str = "float32", block: int = 65536):
+        self.dim, self.codec, self.block = dim, codec, block
+        self.emb_path, self.ids_path, self.scl_path = Path(base + ".emb"), Path(base + ".ids"), Path(base + ".scl")
+        self._paths = [self.emb_path, self.ids_path] + ([self.scl_path] if codec == "int8" else [])
+        for p in self._paths:
+            p.touch(exist_ok=True)
+        self._remap()
+
+    def _remap(self):
+        row_bytes = np.dtype(CODECS[self.codec]).itemsize * self.dim
+        sizes = [self.emb_path.stat().st_size / row_bytes, self.ids_path.stat().st_size / 8]
+        if self.codec == "int8":
+            sizes.append(self.scl_path.stat().st_size / 4)
+        self.n = int(min(sizes))
+        self.consistent = all(s == self.n for s in sizes)
+        if self.n:
+            self._vecs = np.memmap(self.emb_path, dtype=CODECS[self.codec], mode="r", shape=(self.n, self.dim))
+            self._ids = np.memmap(self.ids_path, dtype=np.int64, mode="r", shape=(self.n,))
+            self._scales = np.memmap(self.scl_path, dtype=np.float32, mode="r", shape=(self.n,)) if self.codec == "int8" else None
+        else:
+            self._vecs, self._ids = np.zeros((0, self.dim), dtype=CODECS[self.codec]), np.zeros(0, dtype=np.int64)
+            self._scales = np.zeros(0, dtype=np.float32) if self.codec == "int8" else None
+
+    @property
+    def vecs(self) -> np.ndarray:
+        return self._vecs
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids
+
+    @property
+    def scales(self) -> Optional[np.ndarray]:
+        return self._scales
+
+    def append(self, ids, codes: np.ndarray, scales: Optional[np.ndarray] = None):
+        with self.emb_path.open("ab") as f:
+            f.write(np.asarray(codes, dtype=CODECS[self.codec]).reshape(len(ids), self.dim).tobytes())
+        with self.ids_path.open("ab") as f:
+            f.write(np.asarray(ids, dtype=np.int64).tobytes())
+        if self.codec == "int8":
+            with self.scl_path.open("ab") as f:
+                f.write(np.asarray(scales, dtype=np.float32).tobytes())
+        self._remap()
+
+    def close(self):
+        """Drop the maps, so the files can be truncated or replaced (Windows refuses while they are mapped)."""
+        self._vecs = self._ids = self._scales = None
+
+    def reset(self):
+        self.close()
+        for p in self._paths:
+            p.write_bytes(b"")
+        self.clear_deleted()
+        self._remap()
@@ -1,48 +1,412 @@
-import time, sqlite3
+import hashlib, re, sys, time, sqlite3, threading
+from bisect import bisect_left, insort
+from collections import OrderedDict
 from pathlib import Path
 from dataclasses import dataclass
-from typing import Dict, Tuple, List, Optional
-from ..utils.db import configure_sqlite
+from typing import Dict, Tuple, List, Optional, Set
+from ..utils.db import configure_sqlite, ensure_columns
+
+_STOP = frozenset("a an and are as at be by can do does for from has have how in is it its of on or that the this to was what when where which who why with you your".split())
+_SELF = frozenset("i me my mine myself".split())  # _distill_facts files facts about the user under "User"
+# LWW in SQL: a write only lands if it is at least as new as the stored row
+# (ties go to the tombstone)
+_UPSERT = ("INSERT INTO relations (key, src, rel, dst, ts, bucket, deleted) VALUES (?, ?, ?, ?, ?, ?, ?) "
+           "ON CONFLICT(key) DO UPDATE SET ts = excluded.ts, deleted = excluded.deleted "
+           "WHERE (excluded.ts, excluded.deleted) >= (relations.ts, relations.deleted)")
+# SQLite has no XOR operator: a ^ b == (a | b) - (a & b)
+_XOR_BUCKET = ("INSERT INTO relation_buckets(bucket, digest) VALUES (?, ?) "
+               "ON CONFLICT(bucket) DO UPDATE SET digest = (digest | excluded.digest) - (digest & excluded.digest)")
+BUCKETS, GROUP = 4096, 64  # anti-entropy digest buckets, and buckets per top-level group
+
+def _words(text: str) -> List[str]:
+    """Content words, casefolded, with a plural / third-person "s" dropped so "works" meets "work"."""
+    return [w[:-1] if len(w) > 3 and w.endswith("s") and not w.endswith("ss") else w
+            for w in re.findall(r"\w+", text.casefold()) if w not in _STOP]
+
+def _fold(s: str) -> str:
+    return re.sub(r"\s+", " ", str(s)).strip().casefold()
+
+def norm_key(src: str, rel: str, dst: str) -> str:
+    """Case- and whitespace-insensitive key of a triple (MemoryInbox dedups on it)."""
+    return "|".join(map(_fold, (src, rel, dst)))
 
 @dataclass
 class Rel:
-    src: str; rel: str; dst: str; ts: float
+    __slots__ = ("src", "rel", "dst", "ts", "deleted")
+    src: str; rel: str; dst: str; ts: float; deleted: bool  # deleted: a tombstone
+
+def _rel(src: str, rel: str, dst: str, ts: float, deleted: bool = False) -> Rel:
+    # Node and relation names repeat across many facts; interning stores each string once
+    return Rel(sys.intern(str(src)), sys.intern(str(rel)), sys.intern(str(dst)), float(ts), bool(deleted))
+
+def _wins(r: Rel, cur: Optional[Rel]) -> bool:
+    return cur is None or (r.ts, r.deleted) >= (cur.ts, cur.deleted)
+
+def _hash(data: str) -> int:
+    return int.from_bytes(hashlib.blake2b(data.encode("utf-8"), digest_size=8).digest(), "big") >> 1  # fits a SQLite INTEGER
+
+def _entry(r: Rel) -> int:
+    return _hash(f"{r.src}|{r.rel}|{r.dst}|{r.ts!r}" + ("|deleted" if r.deleted else ""))
+
+def _row(r: Rel) -> tuple:
+    key = f"{r.src}|{r.rel}|{r.dst}"
+    return (key, r.src, r.rel, r.dst, r.ts, _hash(key) % BUCKETS, int(r.deleted))
 
 class LWWGraph:
-    def __init__(self, db_path: str):
+    """LWW-CRDT fact graph persisted in SQLite.
+
+    By default the whole graph is mirrored in memory, with adjacency sets (node -> keys of its
+    outgoing / incoming edges), an index from name words to nodes for entity matching, and a
+    ts-sorted list of keys so the most recent facts are a slice rather than a sort, all updated
+    incrementally by every write.
+
+    With `lazy=True` nothing is loaded at startup: reads go to SQLite (indexed on src, dst, rel
+    and ts) through an LRU of at most `cache_size` hot relations, so memory stays bounded
+    however large the graph grows. Either way the LWW rule is enforced by the upsert itself.
+
+    For anti-entropy every relation falls in one of BUCKETS buckets by key hash, and each bucket
+    keeps the XOR of its entries' (key, ts) hashes in `relation_buckets`, updated in the same
+    transaction as the write. Equal digests mean equal contents, so peers only exchange the
+    buckets whose digests differ (see SyncService).
+
+    `delete` writes a tombstone: a row with `deleted` set that takes part in LWW like any other
+    write (winning ties), replicates as a delete_relation op and is hidden from every read.
+    `gc_tombstones` purges tombstones every known peer has acknowledged (`ack_peer`), and none
+    while no peer is known. A purge is final: a peer first seen afterwards that still holds an
+    older copy of a purged fact brings it back.
+    """
+
+    def __init__(self, db_path: str, lazy: bool = False, cache_size: int = 4096):
         Path(Path(db_path).parent).mkdir(parents=True, exist_ok=True)
         self.conn = sqlite3.connect(db_path, check_same_thread=False)
         configure_sqlite(self.conn)
         self._setup()
-        self._rels: Dict[Tuple[str, str, str], Rel] = self._load()
+        self.lazy, self.cache_size = lazy, cache_size
+        self._lock = threading.Lock()  # apply_ops runs on executor threads
+        self._cache: "OrderedDict[Tuple[str, str, str], Rel]" = OrderedDict()  # lazy mode only
+        self._out: Dict[str, Set[Tuple[str, str, str]]] = {}
+        self._in: Dict[str, Set[Tuple[str, str, str]]] = {}
+        self._word_nodes: Dict[str, Set[str]] = {}
+        self._rels: Dict[Tuple[str, str, str], Rel] = {} if lazy else self._load()
+        live = [r for r in self._rels.values() if not r.deleted]
+        for r in live:
+            self._link(r)
+        self._recent: List[Tuple[float, Tuple[str, str, str]]] = sorted((r.ts, (r.src, r.rel, r.dst)) for r in live)
+        self._digests = [0] * BUCKETS
+        for b, d in self.conn.execute("SELECT bucket, digest FROM relation_buckets"):
+            self._digests[b] = d
+        row = self.conn.execute("SELECT value FROM graph_meta WHERE key='purged_upto'").fetchone()
+        self._purged_upto = float(row[0]) if row else 0.0  # newest ts among garbage-collected tombstones
 
     def _setup(self):
         c = self.conn.cursor()
-        c.execute("CREATE TABLE IF NOT EXISTS relations(key TEXT PRIMARY KEY, src TEXT, rel TEXT, dst TEXT, ts REAL)")
+        c.execute("CREATE TABLE IF NOT EXISTS relations(key TEXT PRIMARY KEY, src TEXT, rel TEXT, dst TEXT, ts REAL, bucket INTEGER, "
+                  "deleted INTEGER NOT NULL DEFAULT 0)")
+        c.execute("CREATE TABLE IF NOT EXISTS relation_buckets(bucket INTEGER PRIMARY KEY, digest INTEGER)")
+        c.execute("CREATE TABLE IF NOT EXISTS relation_tombstones(key TEXT PRIMARY KEY, recorded REAL)")  # recorded: local time
+        c.execute("CREATE TABLE IF NOT EXISTS sync_peers(peer TEXT PRIMARY KEY, acked REAL, seen REAL)")
+        c.execute("CREATE TABLE IF NOT EXISTS graph_meta(key TEXT PRIMARY KEY, value TEXT)")
+        if "bucket" in ensure_columns(self.conn, "relations", {"deleted": "INTEGER NOT NULL DEFAULT 0", "bucket": "INTEGER"}):
+            self._rebuild_buckets()
+        c.execute("CREATE INDEX IF NOT EXISTS idx_relations_bucket ON relations(bucket)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_relations_src ON relations(src)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_relations_dst ON relations(dst)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_relations_rel ON relations(rel)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_relations_ts ON relations(ts)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_relations_src_nocase ON relations(src COLLATE NOCASE)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_relations_dst_nocase ON relations(dst COLLATE NOCASE)")
+        self.conn.commit()
+
+    def _rebuild_buckets(self):
+        """Assign buckets and recompute every digest (graphs created before anti-entropy)."""
+        digests, updates = [0] * BUCKETS, []
+        for row in self.conn.execute("SELECT src, rel, dst, ts, deleted FROM relations"):
+            r = _rel(*row)
+            key, *_, b, _ = _row(r)
+            digests[b] ^= _entry(r)
+            updates.append((b, key))
+        self.conn.executemany("UPDATE relations SET bucket=? WHERE key=?", updates)
+        self.conn.execute("DELETE FROM relation_buckets")
+        self.conn.executemany("INSERT INTO relation_buckets(bucket, digest) VALUES (?, ?)", [(b, d) for b, d in enumerate(digests) if d])
         self.conn.commit()
 
     def _load(self) -> Dict[Tuple[str, str, str], Rel]:
         c = self.conn.cursor()
-        c.execute("SELECT src, rel, dst, ts FROM relations")
-        return {(r[0], r[1], r[2]): Rel(*r) for r in c.fetchall()}
+        c.execute("SELECT src, rel, dst, ts, deleted FROM relations")
+        return {(r.src, r.rel, r.dst): r for r in (_rel(*row) for row in c.fetchall())}
+
+    def _link(self, r: Rel):
+        """Add a new key to the adjacency and word indexes."""
+        key = (r.src, r.rel, r.dst)
+        for node, adj in ((r.src, self._out), (r.dst, self._in)):
+            if node not in self._out and node not in self._in:
+                for w in _words(node):
+                    self._word_nodes.setdefault(w, set()).add(node)
+            adj.setdefault(node, set()).add(key)
+
+    def _put(self, r: Rel):
+        """Record a winning relation in the mirror and its indexes, or in the LRU. Caller holds _lock."""
+        key = (r.src, r.rel, r.dst)
+        if self.lazy:
+            self._cache[key] = r
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return
+        if (old := self._rels.get(key)) is not None and not old.deleted:
+            del self._recent[bisect_left(self._recent, (old.ts, key))]
+            if r.deleted:
+                self._out[r.src].discard(key); self._in[r.dst].discard(key)
+        elif not r.deleted:
+            self._link(r)
+        if not r.deleted:
+            insort(self._recent, (r.ts, key))
+        self._rels[key] = r
+
+    def _current(self, keys: List[Tuple[str, str, str]]) -> Dict[Tuple[str, str, str], Rel]:
+        """Stored state of whichever `keys` exist. Caller holds _lock."""
+        if not self.lazy:
+            return {k: self._rels[k] for k in keys if k in self._rels}
+        out, miss = {}, []
+        for k in keys:
+            if (r := self._cache.get(k)) is not None:
+                self._cache.move_to_end(k)
+                out[k] = r
+            else:
+                miss.append(k)
+        for s in range(0, len(miss), 900):
+            part = [f"{a}|{b}|{c}" for a, b, c in miss[s:s+900]]
+            for row in self.conn.execute(f"SELECT src, rel, dst, ts, deleted FROM relations WHERE key IN ({','.join('?' * len(part))})", part):
+                r = _rel(*row)
+                out[(r.src, r.rel, r.dst)] = r
+                self._put(r)
+        return out
+
+    def get(self, src: str, rel: str, dst: str) -> Optional[Rel]:
+        """Stored state of the relation; check `.deleted`, since tombstones are returned too."""
+        with self._lock:
+            return self._current([(src, rel, dst)]).get((src, rel, dst))
+
+    def has(self, src: str, rel: str, dst: str) -> bool:
+        """A live (not deleted) relation with exactly this key exists."""
+        return (r := self.get(src, rel, dst)) is not None and not r.deleted
+
+    def has_norm(self, src: str, rel: str, dst: str) -> bool:
+        """A live relation with the same `norm_key` exists. Lazy mode finds the source through its
+        NOCASE index, which folds ASCII case only."""
+        want = norm_key(src, rel, dst)
+        with self._lock:
+            if self.lazy:
+                rows = self.conn.execute("SELECT src, rel, dst FROM relations WHERE src = ? COLLATE NOCASE AND deleted = 0",
+                                         (re.sub(r"\s+", " ", src).strip(),))
+                return any(norm_key(*row) == want for row in rows)
+            # Nodes equal up to case and whitespace share their name words; without any, scan every source
+            ws, s = _words(src), _fold(src)
+            nodes = set.intersection(*[self._word_nodes.get(w, set()) for w in ws]) if ws else self._out
+            return any(norm_key(*k) == want for v in nodes if _fold(v) == s for k in self._out.get(v, ()))
 
     def upsert(self, src: str, rel: str, dst: str, ts: Optional[float] = None) -> Rel:
-        key, ts = (src, rel, dst), ts or time.time()
-        if not self._rels.get(key) or ts >= self._rels[key].ts:
-            self._rels[key] = Rel(src, rel, dst, ts)
-            c = self.conn.cursor()
-            # FIX: Corrected typo in SQLite placeholder substitution from 'dst' to '{dst}'
-            c.execute("INSERT OR REPLACE INTO relations (key, src, rel, dst, ts) VALUES (?, ?, ?, ?, ?)",
-                      (f"{src}|{rel}|{dst}", src, rel, dst, ts))
-            self.conn.commit()
-        return self._rels[key]
+        return self._set(_rel(src, rel, dst, ts or time.time()))
+
+    def delete(self, src: str, rel: str, dst: str, ts: Optional[float] = None) -> Rel:
+        return self._set(_rel(src, rel, dst, ts or time.time(), True))
+
+    def _set(self, new: Rel) -> Rel:
+        key = (new.src, new.rel, new.dst)
+        with self._lock:
+            cur = self._current([key]).get(key)
+            if _wins(new, cur):
+                self._write([new], {key: cur} if cur else {})
+                cur = new
+            return cur
 
     def apply_op(self, op: dict) -> bool:
-        if op.get("op") == "upsert_relation":
-            self.upsert(op["src"], op["rel"], op["dst"], float(op["ts"]))
-            return True
-        return False
+        """Apply one peer op (through apply_ops, so purged tombstones stay purged); False if not a graph op."""
+        if op.get("op") not in ("upsert_relation", "delete_relation"):
+            return False
+        self.apply_ops([op])
+        return True
+
+    def apply_ops(self, ops: List[dict]) -> List[Rel]:
+        """Apply a batch of ops in one transaction; returns the relations that won.
+
+        LWW is resolved in memory first (latest ts per key within the batch, then against the
+        current state), so only winners are written, with a single executemany and commit.
+        Blocking: call it from an executor when on the event loop.
+        """
+        batch: Dict[Tuple[str, str, str], Rel] = {}
+        for op in ops:
+            if op.get("op") not in ("upsert_relation", "delete_relation"):
+                continue
+            try:
+                r = _rel(op["src"], op["rel"], op["dst"], op["ts"], op["op"] == "delete_relation")
+            except (KeyError, TypeError, ValueError):
+                continue  # malformed op from a peer
+            key = (r.src, r.rel, r.dst)
+            if _wins(r, batch.get(key)):
+                batch[key] = r
+        with self._lock:
+            current = self._current(list(batch))
+            # A tombstone for an unknown key no newer than what GC already purged is an echo of a
+            # purged one from a peer that hasn't collected it yet: don't bring it back
+            won = [r for key, r in batch.items() if _wins(r, cur := current.get(key)) and not (r.deleted and cur is None and r.ts <= self._purged_upto)]
+            if won:
+                self._write(won, current)
+        return won
+
+    def _write(self, won: List[Rel], current: Dict[Tuple[str, str, str], Rel]):
+        """Persist winning relations and their bucket digest changes in one transaction. Caller holds _lock."""
+        rows, delta, now = [_row(r) for r in won], {}, time.time()
+        for r, row in zip(won, rows):
+            old = current.get((r.src, r.rel, r.dst))
+            delta[row[5]] = delta.get(row[5], 0) ^ _entry(r) ^ (_entry(old) if old else 0)
+        try:
+            self.conn.executemany(_UPSERT, rows)
+            self.conn.executemany(_XOR_BUCKET, list(delta.items()))
+            self.conn.executemany("INSERT OR REPLACE INTO relation_tombstones(key, recorded) VALUES (?, ?)", [(row[0], now) for row in rows if row[6]])
+            self.conn.executemany("DELETE FROM relation_tombstones WHERE key=?",
+                                  [(row[0],) for r, row in zip(won, rows) if not r.deleted and (old := current.get((r.src, r.rel, r.dst))) and old.deleted])
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+        for b, d in delta.items():
+            self._digests[b] ^= d
+        for r in won:
+            self._put(r)
+
+    def digest(self) -> List[int]:
+        """Top-level anti-entropy summary: XOR of the bucket digests of each group of GROUP buckets."""
+        out = [0] * (BUCKETS // GROUP)
+        with self._lock:
+            for b, d in enumerate(self._digests):
+                out[b // GROUP] ^= d
+        return out
+
+    def bucket_digests(self, groups: List[int]) -> Dict[int, int]:
+        with self._lock:
+            return {b: self._digests[b] for g in groups if 0 <= g < BUCKETS // GROUP for b in range(g * GROUP, (g + 1) * GROUP)}
+
+    def bucket_relations(self, buckets: List[int]) -> List[Rel]:
+        out = []
+        with self._lock:
+            for s in range(0, len(buckets), 900):
+                part = buckets[s:s+900]
+                out += [_rel(*row) for row in self.conn.execute(
+                    f"SELECT src, rel, dst, ts, deleted FROM relations WHERE bucket IN ({','.join('?' * len(part))})", part)]
+        return out
+
+    def ack_peer(self, peer: str, upto: float):
+        """`peer` holds every tombstone recorded here before `upto` (local time)."""
+        with self._lock:
+            self.conn.execute("INSERT INTO sync_peers(peer, acked, seen) VALUES (?, ?, ?) "
+                              "ON CONFLICT(peer) DO UPDATE SET acked = max(acked, excluded.acked), seen = excluded.seen", (peer, upto, time.time()))
+            self.conn.commit()
+
+    def gc_tombstones(self, grace_sec: float = 86400, peer_expiry_days: float = 30) -> int:
+        """Purge tombstones recorded more than `grace_sec` ago that every known peer has acknowledged.
+        Peers not heard from in `peer_expiry_days` stop counting as known; with none left nothing is
+        purged, since a peer that connects later could only be told about a delete by its tombstone."""
+        now = time.time()
+        with self._lock:
+            self.conn.execute("DELETE FROM sync_peers WHERE seen < ?", (now - peer_expiry_days * 86400,))
+            row = self.conn.execute("SELECT min(acked) FROM sync_peers").fetchone()
+            if row[0] is None:
+                self.conn.commit()
+                return 0
+            horizon = min(now - grace_sec, row[0])
+            rows = self.conn.execute("SELECT r.src, r.rel, r.dst, r.ts, r.deleted FROM relation_tombstones t JOIN relations r ON r.key = t.key "
+                                     "WHERE t.recorded < ?", (horizon,)).fetchall()
+            if not rows:
+                self.conn.commit()
+                return 0
+            dead, delta = [_rel(*row) for row in rows], {}
+            for r in dead:
+                b = _row(r)[5]
+                delta[b] = delta.get(b, 0) ^ _entry(r)
+            purged_upto = max(self._purged_upto, max(r.ts for r in dead))
+            try:
+                keys = [(_row(r)[0],) for r in dead]
+                self.conn.executemany("DELETE FROM relations WHERE key=?", keys)
+                self.conn.executemany("DELETE FROM relation_tombstones WHERE key=?", keys)
+                self.conn.executemany(_XOR_BUCKET, list(delta.items()))
+                self.conn.execute("INSERT OR REPLACE INTO graph_meta(key, value) VALUES ('purged_upto', ?)", (repr(purged_upto),))
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+            self._purged_upto = purged_upto
+            for b, d in delta.items():
+                self._digests[b] ^= d
+            for r in dead:
+                (self._cache if self.lazy else self._rels).pop((r.src, r.rel, r.dst), None)
+        return len(dead)
 
     def facts_for_prompt(self, n: int = 10) -> str:
-        top = sorted(self._rels.values(), key=lambda r: r.ts, reverse=True)[:n]
-        return "\n".join([f"{r.src} {r.rel} {r.dst}" for r in top])
\ No newline at end of file
+        if n <= 0:
+            return ""
+        with self._lock:
+            if self.lazy:
+                top = [_rel(*row) for row in self.conn.execute("SELECT src, rel, dst, ts FROM relations WHERE deleted = 0 ORDER BY ts DESC LIMIT ?", (n,))]
+            else:
+                top = [self._rels[k] for _, k in reversed(self._recent[-n:])]
+        return "\n".join([f"{r.src} {r.rel} {r.dst}" for r in top])
+
+    def facts_for_query(self, query: str, n: int = 10, hops: int = 2, fanout: int = 32, seed_edges: int = 1000) -> str:
+        """Facts about the entities `query` mentions: edges within `hops` of a matched node, ranked by
+        words shared with the query, then nearest, then newest. Nodes with more than `fanout` edges
+        (hubs such as "User") are matched directly but not expanded through; in lazy mode a matched
+        node contributes at most `seed_edges` of its newest edges."""
+        words = set(_words(query))
+        with self._lock:
+            hop_of: Dict[Tuple[str, str, str], int] = {}
+            rels: Dict[Tuple[str, str, str], Rel] = {}
+            seen = set(frontier := self._match(query, words))
+            for hop in range(1, hops + 1):
+                nxt = []
+                for node in frontier:
+                    edges = self._edges(node, seed_edges if hop == 1 else fanout + 1)
+                    if hop > 1 and len(edges) > fanout:
+                        continue
+                    for r in edges:
+                        key = (r.src, r.rel, r.dst)
+                        if key not in hop_of:
+                            hop_of[key], rels[key] = hop, r
+                        if (other := r.dst if r.src == node else r.src) not in seen:
+                            seen.add(other); nxt.append(other)
+                frontier = nxt
+        shared = lambda r: len(words.intersection(_words(f"{r.src} {r.rel} {r.dst}")))
+        top = sorted(rels.values(), key=lambda r: (-shared(r), hop_of[(r.src, r.rel, r.dst)], -r.ts))[:n]
+        return "\n".join([f"{r.src} {r.rel} {r.dst}" for r in top])
+
+    def _edges(self, node: str, limit: int) -> List[Rel]:
+        """Relations touching `node` (the mirror has them all; lazy mode reads up to `limit`, newest first). Caller holds _lock."""
+        if not self.lazy:
+            return [self._rels[k] for k in (*self._out.get(node, ()), *self._in.get(node, ()))]
+        rows = self.conn.execute("SELECT src, rel, dst, ts FROM relations WHERE src = ? AND deleted = 0 UNION "
+                                 "SELECT src, rel, dst, ts FROM relations WHERE dst = ? AND deleted = 0 ORDER BY ts DESC LIMIT ?", (node, node, limit)).fetchall()
+        return [_rel(*row) for row in rows]
+
+    def _match(self, query: str, words: Set[str]) -> List[str]:
+        """Nodes the query names. Mirror: nodes with at least half of their name words in `words`.
+        Lazy: nodes whose whole name (case-insensitive) is a run of up to 4 query words.
+        First-person words match "User". Caller holds _lock."""
+        if self.lazy:
+            tokens = re.findall(r"\w+", query)
+            grams = list({" ".join(tokens[i:i+k]) for k in range(1, 5) for i in range(len(tokens) - k + 1)})
+            found = set()
+            for s in range(0, len(grams), 900):  # one IN list per statement keeps it under the bound-parameter limit
+                part = grams[s:s+900]
+                marks = ",".join("?" * len(part))
+                for col in ("src", "dst"):
+                    found.update(r[0] for r in self.conn.execute(
+                        f"SELECT DISTINCT {col} FROM relations WHERE {col} COLLATE NOCASE IN ({marks}) AND deleted = 0", part))
+            nodes = list(found)
+            has_user = lambda: self.conn.execute("SELECT 1 FROM relations WHERE (src = 'User' OR dst = 'User') AND deleted = 0 LIMIT 1").fetchone() is not None
+        else:
+            candidates = set().union(*[self._word_nodes.get(w, ()) for w in words])
+            nodes = [v for v in candidates if 2 * len(words.intersection(nw := _words(v))) >= len(nw)]
+            has_user = lambda: "User" in self._out or "User" in self._in
+        if words & _SELF and "User" not in nodes and has_user():
+            nodes.append("User")
+        return nodes
\ No newline at end of file
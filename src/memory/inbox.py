@@ -1,23 +1,62 @@
-import sqlite3
+import re, sqlite3
 from pathlib import Path
 from datetime import datetime
-from typing import List, Tuple
-from ..utils.db import configure_sqlite
+from typing import Iterable, List, Optional, Tuple
+from ..utils.db import configure_sqlite, ensure_columns
+from .graph_crdt import LWWGraph, norm_key as _norm
+
+def _clean(s: str) -> str:
+    return re.sub(r"\s+", " ", str(s)).strip()
 
 class MemoryInbox:
-    def __init__(self, db_path: str):
+    """Candidate facts awaiting approval.
+
+    A unique index on the normalized triple merges repeats of the same fact into one row that
+    keeps the highest confidence, and with a `graph`, facts it already holds (compared the same
+    way) are never queued.
+    """
+
+    def __init__(self, db_path: str, graph: Optional[LWWGraph] = None):
         Path(Path(db_path).parent).mkdir(parents=True, exist_ok=True)
         self.conn = sqlite3.connect(db_path, check_same_thread=False)
         configure_sqlite(self.conn)
+        self.graph = graph
         c = self.conn.cursor()
-        c.execute("CREATE TABLE IF NOT EXISTS pending(id INTEGER PRIMARY KEY, src TEXT, rel TEXT, dst TEXT, confidence REAL, created_at TEXT)")
+        c.execute("CREATE TABLE IF NOT EXISTS pending(id INTEGER PRIMARY KEY, src TEXT, rel TEXT, dst TEXT, confidence REAL, created_at TEXT, norm TEXT)")
+        ensure_columns(self.conn, "pending", {"norm": "TEXT"})
+        if c.execute("SELECT 1 FROM pending WHERE norm IS NULL LIMIT 1").fetchone():
+            self._merge_duplicates()
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_pending_norm ON pending(norm)")
         self.conn.commit()
 
+    def _merge_duplicates(self):
+        """Backfill `norm` for rows queued before dedup, folding repeats into the oldest row at max confidence."""
+        keep = {}
+        for i, s, r, d, conf in self.conn.execute("SELECT id, src, rel, dst, confidence FROM pending ORDER BY id").fetchall():
+            k = _norm(s, r, d)
+            if k in keep:
+                keep[k][1] = max(keep[k][1], conf or 0.0)
+                self.conn.execute("DELETE FROM pending WHERE id=?", (i,))
+            else:
+                keep[k] = [i, conf or 0.0]
+        self.conn.executemany("UPDATE pending SET norm=?, confidence=? WHERE id=?", [(k, conf, i) for k, (i, conf) in keep.items()])
+
     def add(self, src: str, rel: str, dst: str, conf: float = 0.8):
-        c = self.conn.cursor()
-        c.execute("INSERT INTO pending(src,rel,dst,confidence,created_at) VALUES (?,?,?,?,?)",
-                  (src, rel, dst, conf, datetime.utcnow().isoformat()))
-        self.conn.commit()
+        self.add_many([(src, rel, dst, conf)])
+
+    def add_many(self, facts: Iterable[Tuple[str, str, str, float]]) -> int:
+        """Queue (src, rel, dst, confidence) facts in one transaction; returns how many were not already in the graph."""
+        now, rows = datetime.utcnow().isoformat(), []
+        for src, rel, dst, conf in facts:
+            src, rel, dst = _clean(src), _clean(rel), _clean(dst)
+            if not (src and rel and dst) or (self.graph is not None and self.graph.has_norm(src, rel, dst)):
+                continue
+            rows.append((src, rel, dst, float(conf), now, _norm(src, rel, dst)))
+        if rows:
+            self.conn.executemany("INSERT INTO pending(src,rel,dst,confidence,created_at,norm) VALUES (?,?,?,?,?,?) "
+                                  "ON CONFLICT(norm) DO UPDATE SET confidence = max(confidence, excluded.confidence)", rows)
+            self.conn.commit()
+        return len(rows)
 
     def list_pending(self) -> List[Tuple[int, str, str, str]]:
         c = self.conn.cursor()
@@ -25,12 +64,10 @@ class MemoryInbox:
         return c.fetchall()
 
     def pop(self, fact_ids: List[int]) -> List[Tuple[str, str, str, float]]:
-        out, c = [], self.conn.cursor()
-        for i in fact_ids:
-            c.execute("SELECT src,rel,dst,confidence FROM pending WHERE id=?", (i,))
-            row = c.fetchone()
-            if row:
-                out.append(row)
-                c.execute("DELETE FROM pending WHERE id=?", (i,))
+        found = {}
+        for s in range(0, len(fact_ids), 900):
+            part = fact_ids[s:s+900]
+            for i, *row in self.conn.execute(f"DELETE FROM pending WHERE id IN ({','.join('?' * len(part))}) RETURNING id,src,rel,dst,confidence", part).fetchall():
+                found[i] = tuple(row)
         self.conn.commit()
-        return out
\ No newline at end of file
+        return [found[i] for i in dict.fromkeys(fact_ids) if i in found]
\ No newline at end of file
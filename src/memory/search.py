@@ -0,0 +1,14 @@
+# src/memory/search.py
+import re
+
+def fts_query(text: str) -> str:
+    """OR of quoted terms, so user text can't inject FTS5 syntax; `read_csv` stays a phrase."""
+    return " OR ".join('"' + t.replace('"', '""') + '"' for t in re.findall(r"\w+", text))
+
+def rrf(rankings: list, k: int, c: int = 60) -> list:
+    """Reciprocal rank fusion of several best-first id lists."""
+    scores: dict = {}
+    for ranking in rankings:
+        for r, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (c + r + 1)
+    return sorted(scores, key=scores.get, reverse=True)[:k]
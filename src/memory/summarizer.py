@@ -0,0 +1,98 @@
+# src/memory/summarizer.py
+import asyncio, time
+from typing import Optional
+from .conversation_store import ConversationMemory
+
+PROMPT = ("System: You keep a running summary of a conversation between a user and an assistant. "
+          "Update the current summary with the new exchanges. Keep names, facts, decisions, open questions "
+          "and stated preferences; drop small talk. Reply with the updated summary only, as plain prose.\n\n"
+          "Current summary:\n{summary}\n\nNew exchanges:\n{transcript}\n\nUpdated summary:")
+PROMPT_MARGIN = 32
+
+class RollingSummarizer:
+    """Folds each session's older exchanges into its persisted rolling summary while the assistant is idle.
+
+    Runs as a background task. The agent only ever reads `ConversationMemory.get_summary`, so a
+    prompt never waits for a summary: rounds start only after `idle_seconds` without activity
+    while the model is free, and a round is abandoned as soon as a turn starts (the agent calls
+    `ConversationMemory.touch`), between prompt-evaluation chunks or generated tokens, so a new
+    turn waits at most for one of those. The newest `keep_recent` exchanges are left out; each
+    round folds in at most `max_prompt_tokens` worth of prompt.
+    """
+
+    def __init__(self, llm, mem: ConversationMemory, keep_recent: int = 6, min_new: int = 4, idle_seconds: int = 20,
+                 interval_sec: int = 15, max_tokens: int = 256, max_prompt_tokens: int = 1024, batch: int = 64, poll_sec: float = 0.1):
+        self.llm, self.mem = llm, mem
+        self.keep_recent, self.min_new, self.batch = keep_recent, min_new, batch
+        self.idle_seconds, self.interval, self.max_tokens = idle_seconds, interval_sec, max_tokens
+        self.max_prompt_tokens, self.poll_sec = max_prompt_tokens, poll_sec
+
+    def set_llm(self, llm):
+        self.llm = llm
+
+    def _idle(self) -> bool:
+        return time.monotonic() - self.mem.last_activity >= self.idle_seconds and not self.llm.busy
+
+    async def run(self, stop: asyncio.Event):
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), self.interval)
+                break
+            except asyncio.TimeoutError:
+                pass
+            for session_id in list(self.mem.summary_pending):
+                if stop.is_set() or not self._idle():
+                    break
+                started = self.mem.last_activity
+                try:
+                    folded = await self.summarize(session_id)
+                except Exception as e:
+                    print(f"[RollingSummarizer] summarizing session {session_id} failed: {e}")
+                    continue
+                if folded is None:
+                    break  # the user is back
+                if folded == 0 and self.mem.last_activity == started:
+                    self.mem.summary_pending.discard(session_id)
+
+    async def summarize(self, session_id: str) -> Optional[int]:
+        """One round for the session: number of exchanges folded into its summary (0 when fewer than
+        `min_new` are waiting), or None if the round was abandoned for new activity."""
+        loop = asyncio.get_event_loop()
+        rows = await loop.run_in_executor(None, self.mem.unsummarized, session_id, self.keep_recent, self.batch)
+        if len(rows) < self.min_new:
+            return 0
+        llm, summary = self.llm, self.mem.get_summary(session_id)[0]
+        budget = min(llm.n_ctx - self.max_tokens - PROMPT_MARGIN, self.max_prompt_tokens) - llm.token_counter(PROMPT.format(summary=summary or "(none)", transcript=""))
+        lines = []
+        for _, user, assistant in rows:
+            line = f"User: {user}\nAssistant: {assistant}"
+            n = llm.token_counter(line)
+            if n > budget:
+                if lines or budget <= 0:
+                    break
+                line, n = line[:int(len(line) * budget / n)], budget  # one oversized exchange is cut down to fit
+            lines.append(line)
+            budget -= n
+        if not lines:
+            return 0
+        prompt = PROMPT.format(summary=summary or "(none)", transcript="\n\n".join(lines))
+        started, cancel, out = self.mem.last_activity, asyncio.Event(), []
+
+        async def watch():  # also fires while the prompt is still being evaluated, when no tokens arrive
+            while not cancel.is_set():
+                if self.mem.last_activity != started:
+                    cancel.set()  # give the model back to the prompt path
+                await asyncio.sleep(self.poll_sec)
+
+        watcher = asyncio.create_task(watch())
+        try:
+            async for token in llm.stream_async(prompt, self.max_tokens, 0.2, 0.9, 40, 1.1, ["\nUser:", "\nSystem:"], cancel):
+                out.append(token)
+        finally:
+            watcher.cancel()
+        if cancel.is_set() or self.mem.last_activity != started:
+            return None
+        if not (text := "".join(out).strip()):
+            return 0
+        await loop.run_in_executor(None, self.mem.set_summary, session_id, text, rows[len(lines) - 1][0])
+        return len(lines)
\ No newline at end of file
@@ -1,47 +1,586 @@
-import sqlite3
+import hashlib, os, sqlite3, threading, time
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
+from itertools import islice
 from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from ..utils.db import configure_sqlite
+from ..utils.db import configure_sqlite, ensure_columns
+from .ann_index import IVFIndex
+from .chunker import Chunker, NearDupFilter
+from .embedder import LocalEmbedder
+from .embedding_matrix import ResidentMatrix, MemmapMatrix, quantize, top_k
+from .search import fts_query, rrf
 
 def _to_blob(vec: np.ndarray) -> bytes: return vec.astype(np.float32).tobytes()
 def _from_blob(blob: bytes) -> np.ndarray: return np.frombuffer(blob, dtype=np.float32)
+def _chash(text: str) -> str: return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+def _retry(fn, *args, attempts: int = 50, wait: float = 0.1):
+    """Call fn, retrying PermissionError (a file still mapped or open elsewhere on Windows)."""
+    for i in range(attempts):
+        try:
+            return fn(*args)
+        except PermissionError:
+            if i == attempts - 1:
+                raise
+            time.sleep(wait)
+
+class _RWLock:
+    """Any number of readers or one writer; a waiting writer holds off new readers. Not reentrant."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers, self._writing, self._waiting = 0, False, 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing or self._waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
 
 class LiteVectorStore:
-    def __init__(self, db_path: str, embedding_model: str):
+    def __init__(self, db_path: str, embedding_model: str, ann_nprobe: int = 8, ann_min_docs: int = 4096, storage: str = "memory",
+                 quantization: str = "none", rescore_factor: int = 4, query_cache_size: int = 256,
+                 retrieval_mode: str = "dense", lexical_candidates: int = 200, hybrid_prefilter: bool = False,
+                 chunk_tokens: int = 128, chunk_overlap_tokens: int = 16, near_dup_distance: int = 6,
+                 compact_deleted_fraction: float = 0.2, embedder=None):
         Path(Path(db_path).parent).mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
         self.conn = sqlite3.connect(db_path, check_same_thread=False)
         configure_sqlite(self.conn)
-        self.model = SentenceTransformer(embedding_model)
+        # Any object with encode/dim/max_seq_length/count_tokens (see embedder.py); the model loads on first use
+        self.embedder = embedder or LocalEmbedder(embedding_model)
         c = self.conn.cursor()
         c.execute("CREATE TABLE IF NOT EXISTS docs(id INTEGER PRIMARY KEY, source TEXT, chunk_idx INTEGER, text TEXT, embedding BLOB, ts TEXT)")
         c.execute("CREATE INDEX IF NOT EXISTS idx_source ON docs(source)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_docs_ts ON docs(ts)")
+        c.execute("CREATE TABLE IF NOT EXISTS doc_tags(tag TEXT, doc_id INTEGER, PRIMARY KEY(tag, doc_id)) WITHOUT ROWID")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_doc_tags_doc ON doc_tags(doc_id)")
+        c.execute("CREATE TABLE IF NOT EXISTS kb_meta(key TEXT PRIMARY KEY, value TEXT)")
         self.conn.commit()
+        # Compact scan codes; `embedding` keeps float32 and is only read to rescore top candidates
+        ensure_columns(self.conn, "docs", {"qcode": "BLOB", "qscale": "REAL", "chash": "TEXT"})
+        # Content hash doubles as the persistent chunk-embedding cache and the dedup key
+        c.execute("CREATE INDEX IF NOT EXISTS idx_chash ON docs(chash)")
+        self._backfill_hashes()
+        self.stats = {"chunk_hits": 0, "chunk_misses": 0, "chunks_deduped": 0, "query_hits": 0, "query_misses": 0}
+        self._qcache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._qcache_size, self._qlock = query_cache_size, threading.Lock()
+        self.retrieval_mode, self.lexical_candidates, self.hybrid_prefilter = retrieval_mode, lexical_candidates, hybrid_prefilter
+        self.fts = self._setup_fts()
+        self.chunk_tokens, self.chunk_overlap_tokens = chunk_tokens, chunk_overlap_tokens
+        self.near_dup_distance = near_dup_distance
+        # source -> doc ids, built on the first source-scoped query and kept current by inserts
+        self._partitions: Optional[Dict[str, array]] = None
+        self._partition_keys: List[str] = []
+        # Serializes ingest, deletes and compaction; queries never take it
+        self._write_lock = threading.RLock()
+        # Queries read the matrix, IVF lists and partitions under `read`; every change to them in
+        # memory (append, delete marks, the compaction and retraining swaps) is a short `write`
+        self._rw = _RWLock()
+        # Held while k-means runs (outside _write_lock) and by compaction, which retrains too
+        self._train_lock = threading.Lock()
+        self._reloads = 0  # bumped when a rolled-back write rebuilds the matrix under a training run
+        self.compact_deleted_fraction = compact_deleted_fraction
+        self._compactor: Optional[threading.Thread] = None
+        self.codec, self.rescore_factor = ("float32" if quantization == "none" else quantization), rescore_factor
+        if self.codec != "float32":
+            self.migrate_quantization()
+        # Below ann_min_docs the index stays untrained and retrieval is an exact scan
+        self.index = IVFIndex(self.conn, nprobe=ann_nprobe, min_train_size=ann_min_docs)
+        dim = self._resolve_dim()
+        if storage == "mmap":
+            # Sidecar files next to the DB; vectors stay in the page cache instead of the heap
+            self.matrix = MemmapMatrix(db_path, dim, codec=self.codec)
+            self._sync_sidecar()
+        else:
+            n = self.conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+            self.matrix = ResidentMatrix(dim, capacity=max(1024, n), codec=self.codec)
+            self._copy_embeddings()
+        self._maybe_compact()
 
-    def add_document(self, text: str, source: str = "user", chunk_size: int = 500, overlap: int = 50) -> int:
-        step = max(1, chunk_size - max(0, overlap))
-        chunks = [text[i:i+chunk_size] for i in range(0, max(len(text), 1), step)]
-        if not chunks:
-            return 0
-        embs = self.model.encode(chunks, normalize_embeddings=True)
+    def _setup_fts(self) -> bool:
+        """External-content FTS5 index over docs.text, maintained by triggers. False if FTS5 is unavailable."""
         c = self.conn.cursor()
-        for idx, (t, e) in enumerate(zip(chunks, embs)):
-            c.execute(
-                "INSERT INTO docs(source,chunk_idx,text,embedding,ts) VALUES (?,?,?,?,?)",
-                (source, idx, t, _to_blob(e), datetime.utcnow().isoformat())
-            )
+        existed = c.execute("SELECT 1 FROM sqlite_master WHERE name='docs_fts'").fetchone()
+        try:
+            c.execute("CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(text, content='docs', content_rowid='id')")
+        except sqlite3.OperationalError:
+            return False
+        c.execute("CREATE TRIGGER IF NOT EXISTS docs_fts_ai AFTER INSERT ON docs BEGIN "
+                  "INSERT INTO docs_fts(rowid, text) VALUES (new.id, new.text); END")
+        c.execute("CREATE TRIGGER IF NOT EXISTS docs_fts_ad AFTER DELETE ON docs BEGIN "
+                  "INSERT INTO docs_fts(docs_fts, rowid, text) VALUES ('delete', old.id, old.text); END")
+        c.execute("CREATE TRIGGER IF NOT EXISTS docs_fts_au AFTER UPDATE OF text ON docs BEGIN "
+                  "INSERT INTO docs_fts(docs_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+                  "INSERT INTO docs_fts(rowid, text) VALUES (new.id, new.text); END")
+        if not existed:
+            c.execute("INSERT INTO docs_fts(docs_fts) VALUES ('rebuild')")  # index rows that predate the table
         self.conn.commit()
-        return len(chunks)
+        return True
 
-    def retrieve_context(self, query: str, k: int = 3) -> str:
-        q = self.model.encode([query], normalize_embeddings=True)[0]
+    def _resolve_dim(self) -> int:
+        """Embedding width from the stored data when possible, so opening a KB doesn't load the model."""
         c = self.conn.cursor()
-        c.execute("SELECT text, embedding FROM docs")
-        rows = c.fetchall()
-        if not rows:
-            return ""
-        texts, sims = zip(*[(t, float(np.dot(q, _from_blob(blob)))) for t, blob in rows])
-        import numpy as _np
-        idxs = _np.argsort(sims)[::-1][:k]
-        return "\n\n".join([texts[i] for i in idxs])
\ No newline at end of file
+        if row := c.execute("SELECT value FROM kb_meta WHERE key='dim'").fetchone():
+            return int(row[0])
+        row = c.execute("SELECT length(embedding) FROM docs LIMIT 1").fetchone()
+        dim = row[0] // 4 if row else self.embedder.dim
+        c.execute("INSERT OR REPLACE INTO kb_meta(key, value) VALUES ('dim', ?)", (str(dim),))
+        self.conn.commit()
+        return dim
+
+    def _backfill_hashes(self, batch: int = 10000):
+        c = self.conn.cursor()
+        while rows := c.execute("SELECT id, text FROM docs WHERE chash IS NULL LIMIT ?", (batch,)).fetchall():
+            c.executemany("UPDATE docs SET chash=? WHERE id=?", [(_chash(t or ""), i) for i, t in rows])
+        self.conn.commit()
+
+    def cache_stats(self) -> dict:
+        """Hit/miss counters for the chunk-embedding cache, insert dedup and the query LRU."""
+        return dict(self.stats, query_cache_entries=len(self._qcache))
+
+    def migrate_quantization(self, batch: int = 10000) -> int:
+        """Fill `qcode`/`qscale` for rows that predate (or were written without) quantization, in one transaction."""
+        c, done, last = self.conn.cursor(), 0, -1
+        prev = c.execute("SELECT value FROM kb_meta WHERE key='qcodec'").fetchone()
+        if prev and prev[0] != self.codec:
+            c.execute("UPDATE docs SET qcode=NULL, qscale=NULL")  # codes from another codec are re-derived
+        c.execute("INSERT OR REPLACE INTO kb_meta(key, value) VALUES ('qcodec', ?)", (self.codec,))
+        while rows := c.execute("SELECT id, embedding FROM docs WHERE qcode IS NULL AND id > ? ORDER BY id LIMIT ?", (last, batch)).fetchall():
+            ids, blobs = zip(*rows)
+            codes, scales = quantize(np.frombuffer(b"".join(blobs), dtype=np.float32).reshape(len(ids), -1), self.codec)
+            c.executemany("UPDATE docs SET qcode=?, qscale=? WHERE id=?",
+                          [(codes[i].tobytes(), float(scales[i]) if scales is not None else None, ids[i]) for i in range(len(ids))])
+            done, last = done + len(ids), ids[-1]
+        self.conn.commit()
+        return done
+
+    def _copy_embeddings(self, after_id: int = -1, batch: int = 10000, matrix=None):
+        """Load codes (or float32 BLOBs) with id > after_id into `matrix` (self.matrix), one fetch batch at a time."""
+        matrix = self.matrix if matrix is None else matrix
+        c = self.conn.cursor()
+        if self.codec == "float32":
+            c.execute("SELECT id, embedding, NULL FROM docs WHERE id > ? ORDER BY id", (after_id,))
+        else:
+            c.execute("SELECT id, qcode, qscale FROM docs WHERE id > ? ORDER BY id", (after_id,))
+        dtype = matrix.vecs.dtype
+        while rows := c.fetchmany(batch):
+            ids, blobs, scales = zip(*rows)
+            matrix.append(ids, np.frombuffer(b"".join(blobs), dtype=dtype),
+                               np.asarray(scales, dtype=np.float32) if self.codec == "int8" else None)
+
+    def _sync_sidecar(self):
+        """Catch the sidecar up with the docs table, or rebuild it from BLOBs if the two diverged.
+
+        Rows of docs deleted since the last compaction are still in the files and are marked deleted.
+        """
+        m, c = self.matrix, self.conn.cursor()
+        if m.consistent:
+            last = int(m.ids[-1]) if len(m) else -1
+            c.execute("SELECT id FROM docs WHERE id <= ? ORDER BY id", (last,))
+            live = np.fromiter((r[0] for r in c), dtype=np.int64)
+            gone = ~np.isin(m.ids, live)
+            if len(m) - int(gone.sum()) == len(live):  # every live doc has its row
+                m.clear_deleted()
+                m.mark_deleted(m.ids[gone])
+                self._copy_embeddings(last)
+                return
+        self.rebuild_sidecar()
+
+    def rebuild_sidecar(self):
+        self.matrix.reset()
+        self._copy_embeddings()
+
+    def _maybe_train_index(self):
+        """(Re)train IVF once the live corpus has grown enough. k-means runs on a snapshot of the live
+        rows without the write lock, so other writers carry on; what they add or delete meanwhile is
+        patched into the result before it is swapped in. Skipped while another training or compaction runs."""
+        if not self._train_lock.acquire(blocking=False):
+            return
+        try:
+            with self._write_lock:
+                m = self.matrix
+                if not self.index.needs_training(len(m) - m.n_deleted):
+                    return
+                # Rows deleted since the last compaction are still in the matrix; cluster only the live ones
+                ids, vecs = m.live()
+                ids, reloads = np.array(ids), self._reloads
+            try:
+                built = self.index.build(ids, vecs)
+            except Exception:
+                if self._reloads == reloads:
+                    raise
+                return  # the matrix was rebuilt under it; the next ingest retrains
+            with self._write_lock:
+                if self._reloads != reloads:
+                    return
+                live = m.live()[0]  # compaction waits for _train_lock, so m is still the matrix
+                new = live[live > ids[-1]]
+                self.index.patch(*built, ids[~np.isin(ids, live)], new, m.decode(m.rows_for(new)))
+                self.index.save(*built, len(live))
+                with self._rw.write():
+                    self.index.use(*built, len(live))
+                self.conn.commit()
+        finally:
+            self._train_lock.release()
+
+    def _reload_derived(self):
+        """Re-sync the index and matrix with the DB after a rolled-back write."""
+        self._reloads += 1
+        with self._rw.write():
+            self.index.reload()
+            self._partitions = None
+            if isinstance(self.matrix, MemmapMatrix):
+                self._sync_sidecar()
+            else:
+                self.matrix = ResidentMatrix(self.matrix.dim, capacity=max(1024, len(self.matrix)), codec=self.codec)
+                self._copy_embeddings()
+
+    def add_document(self, text: str, source: str = "user", chunk_size: Optional[int] = None, overlap: Optional[int] = None,
+                     tags: Optional[Sequence[str]] = None) -> int:
+        return self.add_documents([(text, source, tags)], chunk_size, overlap)
+
+    def add_documents(self, docs: Iterable[tuple], chunk_size: Optional[int] = None, overlap: Optional[int] = None,
+                      encode_batch: int = 1024, progress: Optional[Callable[[int, int], None]] = None) -> int:
+        """Bulk-ingest an iterable of (text, source) or (text, source, tags) tuples.
+
+        Texts are chunked lazily on sentence/paragraph boundaries within `chunk_size` model tokens
+        (default `chunk_tokens`), and chunks that are SimHash near-duplicates of an earlier chunk of
+        the same document are dropped before encoding. Repeats across documents or sources are left
+        to the exact-hash dedup, which keeps one row per source and reuses the stored embedding. Chunks from consecutive documents share
+        `encode_batch`-sized encode calls and all rows are written with executemany in one
+        transaction. `progress(docs_done, chunks_done)` is called after every batch. Returns the
+        number of chunks stored.
+        """
+        return self._ingest(docs, chunk_size, overlap, encode_batch, progress)
+
+    def replace_source(self, source: str, texts, tags: Optional[Sequence[str]] = None,
+                       chunk_size: Optional[int] = None, overlap: Optional[int] = None) -> int:
+        """Atomically swap everything stored under `source` for the chunks of `texts` (a string or list).
+
+        Chunks whose content is unchanged reuse their old embeddings instead of being re-encoded.
+        """
+        texts = [texts] if isinstance(texts, str) else list(texts)
+        return self._ingest([(t, source, tags) for t in texts], chunk_size, overlap, replace=source)
+
+    def delete_source(self, source: str) -> int:
+        """Delete every chunk stored under `source`; returns the number of chunks removed."""
+        with self._write_lock:
+            try:
+                n = self._delete_source(source)
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                self._reload_derived()
+                raise
+        self._maybe_compact()
+        return n
+
+    def _delete_source(self, source: str) -> int:
+        """Remove `source` from the docs, tags, IVF lists, matrix and partitions. Caller commits."""
+        c = self.conn.cursor()
+        ids = [r[0] for r in c.execute("SELECT id FROM docs WHERE source=?", (source,)).fetchall()]
+        if not ids:
+            return 0
+        c.execute("DELETE FROM doc_tags WHERE doc_id IN (SELECT id FROM docs WHERE source=?)", (source,))
+        c.execute("DELETE FROM docs WHERE source=?", (source,))  # docs_fts_ad drops the FTS rows
+        with self._rw.write():
+            self.index.remove(ids)
+            self.matrix.mark_deleted(ids)
+            if self._partitions is not None and self._partitions.pop(source, None) is not None:
+                self._partition_keys.remove(source)
+        return len(ids)
+
+    def _ingest(self, docs: Iterable[tuple], chunk_size: Optional[int], overlap: Optional[int], encode_batch: int = 1024,
+                progress: Optional[Callable[[int, int], None]] = None, replace: Optional[str] = None) -> int:
+        # Never let a chunk exceed what the embedding model reads (2 slots for CLS/SEP)
+        budget = min(chunk_size or self.chunk_tokens, self.embedder.max_seq_length - 2)
+        chunker = Chunker(self.embedder.count_tokens, budget,
+                          self.chunk_overlap_tokens if overlap is None else overlap)
+        def stream():
+            for n_doc, (text, source, *rest) in enumerate(docs, 1):
+                tags = sorted({t.strip() for t in (rest[0] or [])} - {""}) if rest else []
+                idx, near_dups = 0, NearDupFilter(self.near_dup_distance)  # per document, so no source loses its copy
+                for chunk in chunker.chunks(text):
+                    if near_dups.seen(chunk):
+                        self.stats["chunks_deduped"] += 1
+                        continue
+                    yield n_doc, source, idx, chunk, tags
+                    idx += 1
+        with self._write_lock:
+            # Deleted rows keep their ids in the matrix until compaction, so never hand those out again
+            last_row = int(self.matrix.ids[-1]) if len(self.matrix) else 0
+            next_id = max(self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM docs").fetchone()[0], last_row) + 1
+            total, chunks, reuse = 0, stream(), {}
+            try:
+                if replace is not None:
+                    reuse = dict(self.conn.execute("SELECT chash, embedding FROM docs WHERE source=?", (replace,)).fetchall())
+                    self._delete_source(replace)
+                while batch := list(islice(chunks, encode_batch)):
+                    n = self._write_batch(next_id, batch, reuse=reuse)
+                    next_id, total = next_id + n, total + n
+                    if progress:
+                        progress(batch[-1][0], total)
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                self._reload_derived()
+                raise
+        self._maybe_train_index()
+        if replace is not None:
+            self._maybe_compact()
+        return total
+
+    def _write_batch(self, next_id: int, batch: list, encode_batch_size: int = 64, reuse: Optional[dict] = None) -> int:
+        hashes = [_chash(b[3]) for b in batch]
+        # Drop chunks already stored under the same source (re-ingest) and repeats within the batch
+        seen = set(self._select_in("SELECT source, chash FROM docs WHERE chash IN ({})", list(set(hashes))))
+        keep = []
+        for b, h in zip(batch, hashes):
+            if (b[1], h) not in seen:
+                seen.add((b[1], h)); keep.append((b, h))
+        self.stats["chunks_deduped"] += len(batch) - len(keep)
+        if not keep:
+            return 0
+        # Reuse stored embeddings for identical content from any source; encode only the misses
+        cache = {h: _from_blob(e) for h, e in self._select_in("SELECT chash, embedding FROM docs WHERE chash IN ({})", list({h for _, h in keep}))}
+        cache.update((h, _from_blob(reuse[h])) for _, h in keep if reuse and h in reuse and h not in cache)
+        misses = list(dict.fromkeys(h for _, h in keep if h not in cache))
+        if misses:
+            text_of = {h: b[3] for b, h in keep}
+            cache.update(zip(misses, self.embedder.encode([text_of[h] for h in misses], encode_batch_size)))
+        self.stats["chunk_hits"] += len(keep) - len(misses); self.stats["chunk_misses"] += len(misses)
+        batch, hashes = [b for b, _ in keep], [h for _, h in keep]
+        ids = list(range(next_id, next_id + len(batch)))
+        embs = np.stack([cache[h] for h in hashes]).astype(np.float32)
+        codes, scales = quantize(embs, self.codec)
+        quantized, ts = self.codec != "float32", datetime.utcnow().isoformat()
+        self.conn.executemany(
+            "INSERT INTO docs(id,source,chunk_idx,text,embedding,ts,qcode,qscale,chash) VALUES (?,?,?,?,?,?,?,?,?)",
+            [(ids[i], source, idx, t, _to_blob(embs[i]), ts, codes[i].tobytes() if quantized else None,
+              float(scales[i]) if scales is not None else None, hashes[i]) for i, (_, source, idx, t, _) in enumerate(batch)]
+        )
+        self.conn.executemany("INSERT OR IGNORE INTO doc_tags(tag, doc_id) VALUES (?,?)",
+                              [(tag, ids[i]) for i, b in enumerate(batch) for tag in b[4]])
+        with self._rw.write():
+            self.index.add(ids, embs)
+            self.matrix.append(ids, codes, scales)
+            if self._partitions is not None:
+                for doc_id, b in zip(ids, batch):
+                    self._partition(b[1] or "").append(doc_id)
+        return len(ids)
+
+    def compact(self) -> dict:
+        """Rebuild the matrix (or sidecar) without deleted rows, retrain the IVF index on what is
+        left, optimize FTS and VACUUM once enough of the DB file is free pages."""
+        with self._train_lock, self._write_lock:
+            dropped, m = self.matrix.n_deleted, self.matrix
+            # The new matrix and index are built off to the side; queries keep using the live ones
+            if isinstance(m, MemmapMatrix):
+                fresh = MemmapMatrix(self.db_path + ".compact", m.dim, codec=self.codec)
+                fresh.reset()
+            else:
+                fresh = ResidentMatrix(m.dim, capacity=max(1024, len(m) - dropped), codec=self.codec)
+            self._copy_embeddings(matrix=fresh)
+            built = self.index.build(fresh.ids, fresh.decoded) if len(fresh) >= self.index.min_train_size else None
+            if built:
+                self.index.save(*built, len(fresh))
+            with self._rw.write():
+                if isinstance(m, MemmapMatrix):
+                    # No query holds the old maps here. The files are replaced, never rewritten in
+                    # place, and unmapped first since Windows refuses to replace a mapped file
+                    m.close(); fresh.close()
+                    for src, dst in zip(fresh._paths, m._paths):
+                        _retry(os.replace, src, dst)
+                    fresh = MemmapMatrix(self.db_path, m.dim, codec=self.codec)
+                self.matrix = fresh
+                if built:
+                    self.index.use(*built, len(fresh))
+                elif self.index.trained:
+                    self.index.clear()
+            if self.fts:
+                self.conn.execute("INSERT INTO docs_fts(docs_fts) VALUES ('optimize')")
+            self.conn.commit()
+            free = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+            pages = self.conn.execute("PRAGMA page_count").fetchone()[0]
+            vacuumed = bool(pages) and free / pages >= self.compact_deleted_fraction
+            if vacuumed:
+                # Not on self.conn: queries from other threads may have statements open on it
+                vc = sqlite3.connect(self.db_path)
+                try:
+                    configure_sqlite(vc)
+                    vc.execute("VACUUM")
+                finally:
+                    vc.close()
+        return {"rows_dropped": dropped, "rows": len(self.matrix), "vacuumed": vacuumed}
+
+    def _maybe_compact(self):
+        """Start a background compaction once the deleted share of the matrix crosses the threshold."""
+        if not self.compact_deleted_fraction or self.matrix.deleted_fraction < self.compact_deleted_fraction:
+            return
+        with self._qlock:
+            if self._compactor is None or not self._compactor.is_alive():
+                self._compactor = threading.Thread(target=self._compact_logged, name="kb-compact", daemon=True)
+                self._compactor.start()
+
+    def _compact_logged(self):
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"[LiteVectorStore] background compaction failed: {e}")
+
+    def _partition(self, source: str) -> array:
+        if (part := self._partitions.get(source)) is None:
+            part = self._partitions[source] = array("q")
+            insort(self._partition_keys, source)
+        return part
+
+    def _partition_ids(self, prefix: str) -> np.ndarray:
+        """Doc ids of every source starting with `prefix`, from the in-memory per-source partitions. Caller holds _rw.read."""
+        if (partitions := self._partitions) is None:
+            # Concurrent readers may both build them; the results are equal and writers are held off
+            partitions = {}
+            for source, doc_id in self.conn.execute("SELECT source, id FROM docs ORDER BY id"):
+                if (part := partitions.get(source or "")) is None:
+                    part = partitions[source or ""] = array("q")
+                part.append(doc_id)
+            self._partitions, self._partition_keys = partitions, sorted(partitions)
+        keys = self._partition_keys
+        lo, hi = bisect_left(keys, prefix), bisect_left(keys, prefix + "\U0010ffff")
+        parts = [np.array(partitions[s], dtype=np.int64) for s in keys[lo:hi]]
+        return np.sort(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+
+    @staticmethod
+    def _filter_clause(source: Optional[str], since: Optional[str], until: Optional[str], tags: Sequence[str]) -> Tuple[str, list]:
+        conds, params = [], []
+        if source:
+            conds.append("d.source >= ? AND d.source < ?"); params += [source, source + "\U0010ffff"]
+        if since:
+            conds.append("d.ts >= ?"); params.append(since)
+        if until:
+            conds.append("d.ts < ?"); params.append(until)
+        for tag in tags:
+            conds.append("d.id IN (SELECT doc_id FROM doc_tags WHERE tag = ?)"); params.append(tag)
+        return " AND ".join(conds) or "1", params
+
+    def _filtered_ids(self, source: Optional[str], since: Optional[str], until: Optional[str], tags: Sequence[str]) -> np.ndarray:
+        if source and not (since or until or tags):
+            return self._partition_ids(source)
+        where, params = self._filter_clause(source, since, until, tags)
+        rows = self.conn.execute(f"SELECT d.id FROM docs d WHERE {where} ORDER BY d.id", params).fetchall()
+        return np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+
+    def _select_in(self, sql: str, values: list) -> list:
+        """Run `sql` with its `IN ({})` filled from `values`, in chunks under SQLite's bound-parameter limit."""
+        c, out = self.conn.cursor(), []
+        for s in range(0, len(values), 900):
+            part = values[s:s+900]
+            out.extend(c.execute(sql.format(",".join("?" * len(part))), part).fetchall())
+        return out
+
+    def _encode_query(self, query: str) -> np.ndarray:
+        """Embed a query through a bounded LRU keyed by its content hash."""
+        key = _chash(query)
+        with self._qlock:
+            if (q := self._qcache.get(key)) is not None:
+                self._qcache.move_to_end(key); self.stats["query_hits"] += 1
+                return q
+        q = self.embedder.encode([query])[0]
+        with self._qlock:
+            self._qcache[key] = q; self.stats["query_misses"] += 1
+            while len(self._qcache) > self._qcache_size:
+                self._qcache.popitem(last=False)
+        return q
+
+    def _texts(self, ids: list) -> list:
+        out = dict(self._select_in("SELECT id, text FROM docs WHERE id IN ({})", ids))
+        return [out[i] for i in ids if i in out]
+
+    def _rescore(self, ids: list, q: np.ndarray, k: int) -> list:
+        """Re-rank first-pass candidates with their full-precision float32 embeddings."""
+        vecs = {i: _from_blob(b) for i, b in self._select_in("SELECT id, embedding FROM docs WHERE id IN ({})", ids)}
+        ids = [i for i in ids if i in vecs]
+        if not ids:
+            return []
+        best = top_k(np.stack([vecs[i] for i in ids]) @ q, k)
+        return [ids[j] for j in best.tolist()]
+
+    def _lexical(self, query: str, limit: int, filters: Optional[tuple] = None) -> list:
+        if not (match := fts_query(query)):
+            return []
+        c = self.conn.cursor()
+        if filters is None:
+            c.execute("SELECT rowid FROM docs_fts WHERE docs_fts MATCH ? ORDER BY rank LIMIT ?", (match, limit))
+        else:
+            where, params = self._filter_clause(*filters)
+            c.execute(f"SELECT f.rowid FROM docs_fts f JOIN docs d ON d.id = f.rowid WHERE docs_fts MATCH ? AND {where} ORDER BY f.rank LIMIT ?",
+                      [match, *params, limit])
+        return [r[0] for r in c.fetchall()]
+
+    def _dense(self, q: np.ndarray, k: int, nprobe: int | None = None, rows: Optional[np.ndarray] = None) -> list:
+        if rows is None and self.index.trained:
+            rows = self.matrix.rows_for(self.index.search(q, nprobe))
+        if self.codec == "float32":
+            return self.matrix.search(q, k, rows)[0].tolist()
+        return self._rescore(self.matrix.search(q, k * self.rescore_factor, rows)[0].tolist(), q, k)
+
+    def retrieve_context(self, query: str, k: int = 3, nprobe: int | None = None, mode: Optional[str] = None,
+                         source: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+                         tags: Optional[Sequence[str]] = None) -> str:
+        return "\n\n".join(self._texts(self.retrieve_ids(query, k, nprobe, mode, source, since, until, tags)))
+
+    def retrieve_ids(self, query: str, k: int = 3, nprobe: int | None = None, mode: Optional[str] = None,
+                     source: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+                     tags: Optional[Sequence[str]] = None) -> List[int]:
+        """Doc ids of the top-k chunks for `query`, best first. mode "dense" ranks by cosine similarity; "hybrid" fuses it with
+        FTS5 BM25 ranking (RRF). With hybrid_prefilter, dense scoring only covers the BM25 candidates.
+
+        `source` (prefix), `since`/`until` (ISO timestamps) and `tags` (all required) are applied
+        before any vector is scored, so a scoped query only touches the matching partition.
+        """
+        if not len(self.matrix):
+            return []
+        tags = list(tags or [])
+        filters = (source, since, until, tags) if (source or since or until or tags) else None
+        q = self._encode_query(query)
+        with self._rw.read():
+            rows = None
+            if filters:
+                if not len(allowed := self._filtered_ids(*filters)):
+                    return []
+                rows = self.matrix.rows_for(allowed)
+            if (mode or self.retrieval_mode) != "hybrid" or not self.fts or not (lexical := self._lexical(query, self.lexical_candidates, filters)):
+                return self._dense(q, k, nprobe, rows)
+            # Too few keyword hits to fill k results: score the whole (filtered) corpus instead
+            if self.hybrid_prefilter and len(lexical) >= k:
+                rows = self.matrix.rows_for(np.asarray(lexical))
+            dense = self._dense(q, max(k, self.lexical_candidates), nprobe, rows)
+        return rrf([lexical, dense], k)
\ No newline at end of file
@@ -1,19 +1,114 @@
 import time, asyncio
 from typing import List, Tuple
-from ..memory.graph_crdt import LWWGraph
+from ..memory.graph_crdt import LWWGraph, Rel, BUCKETS, GROUP
 from ..mesh.p2p import P2P
 
+def _ops(rels: List[Rel]) -> List[dict]:
+    return [{"op":"delete_relation" if r.deleted else "upsert_relation","src":r.src,"rel":r.rel,"dst":r.dst,"ts":r.ts} for r in rels]
+
 class SyncService:
-    def __init__(self, graph: LWWGraph, p2p: P2P):
-        self.graph, self.p2p = graph, p2p
+    """Replicates the memory graph between peers.
+
+    Local writes are pushed as they happen (`broadcast_relations`). Anti-entropy catches up peers
+    that were offline or joined late. Rounds start with each new peer and then every
+    `interval_sec`. Each round works down the graph's digest tree:
+      crdt_digest  -> per-group digests
+      crdt_buckets <- bucket digests of the groups that differ
+      crdt_pull    -> buckets that differ; both sides send those buckets' relations as crdt_ops
+    Ops are sent in chunks of `chunk_ops`, so traffic follows the size of the difference, not
+    the size of the graph. A round that finds the two graphs equal counts as the peer
+    acknowledging every tombstone held here; after each round, tombstones acknowledged by all
+    known peers (and older than `tombstone_grace_sec`) are garbage-collected.
+    """
+
+    def __init__(self, graph: LWWGraph, p2p: P2P, chunk_ops: int = 500, tombstone_grace_sec: int = 86400):
+        self.graph, self.p2p, self.chunk_ops, self.tombstone_grace = graph, p2p, chunk_ops, tombstone_grace_sec
         self.p2p.on("crdt_ops", self._on_ops)
+        self.p2p.on("crdt_digest", self._on_digest)
+        self.p2p.on("crdt_buckets", self._on_buckets)
+        self.p2p.on("crdt_pull", self._on_pull)
+
+    async def _blocking(self, fn, *args):
+        return await asyncio.get_event_loop().run_in_executor(None, fn, *args)
+
+    def _open(self, env: dict):
+        return self.p2p.decrypt_from(env["sender_pub"], env["nonce"], env["ciphertext"])
 
     async def broadcast_relations(self, rels: List[Tuple[str,str,str,float]]):
-        ops = [{"op":"upsert_relation","src":s,"rel":r,"dst":d,"ts":ts} for s,r,d,ts in rels]
-        for peer in self.p2p.peers:
+        """Apply the relations locally as one batch, then push the ones that won to every peer."""
+        await self._publish([{"op":"upsert_relation","src":s,"rel":r,"dst":d,"ts":ts} for s,r,d,ts in rels])
+
+    async def retract_relations(self, rels: List[Tuple[str,str,str]]):
+        """Delete relations (as tombstones) locally and on every peer."""
+        now = time.time()
+        await self._publish([{"op":"delete_relation","src":s,"rel":r,"dst":d,"ts":now} for s,r,d in rels])
+
+    async def _publish(self, ops: List[dict]):
+        ops = _ops(await self._blocking(self.graph.apply_ops, ops))
+        for peer in self.p2p.peers if ops else []:
             await self.p2p.send_encrypted(peer, "crdt_ops", {"ops": ops})
 
     async def _on_ops(self, env: dict):
-        payload = self.p2p.decrypt_from(env["sender_pub"], env["nonce"], env["ciphertext"])
-        if payload:
-            for op in payload.get("ops", []): self.graph.apply_op(op)
\ No newline at end of file
+        payload = self._open(env)
+        if payload and (ops := payload.get("ops")):
+            await self._blocking(self.graph.apply_ops, ops)
+
+    async def run(self, stop: asyncio.Event, interval_sec: int = 300, poll_sec: int = 5):
+        known, next_round = set(), 0.0
+        while not stop.is_set():
+            peers = set(self.p2p.peers)
+            full = time.monotonic() >= next_round
+            if full:
+                due, next_round = peers, time.monotonic() + interval_sec
+            else:
+                due = peers - known  # joined or reconnected since the last look
+            for peer in due:
+                try:
+                    await self._blocking(self.graph.ack_peer, peer, 0.0)  # known from now on, holding up GC until it syncs
+                    await self.anti_entropy(peer)
+                except Exception as e:
+                    print(f"[SyncService] anti-entropy with {peer} failed: {e}")
+            known = peers
+            if full:
+                try:
+                    await self._blocking(self.graph.gc_tombstones, self.tombstone_grace)
+                except Exception as e:
+                    print(f"[SyncService] tombstone GC failed: {e}")
+            try:
+                await asyncio.wait_for(stop.wait(), poll_sec)
+            except asyncio.TimeoutError:
+                pass
+
+    async def anti_entropy(self, peer: str):
+        await self.p2p.send_encrypted(peer, "crdt_digest", {"buckets": BUCKETS, "groups": await self._blocking(self.graph.digest)})
+
+    async def _on_digest(self, env: dict):
+        if not (payload := self._open(env)) or payload.get("buckets") != BUCKETS:
+            return
+        now = time.time()
+        mine = await self._blocking(self.graph.digest)
+        theirs = payload.get("groups", [])
+        groups = [g for g, (a, b) in enumerate(zip(mine, theirs)) if a != b]
+        if not groups and len(theirs) == len(mine):
+            await self._blocking(self.graph.ack_peer, env["from"], now)  # it holds everything we had at `now`
+        elif groups:
+            digests = await self._blocking(self.graph.bucket_digests, groups)
+            await self.p2p.send_encrypted(env["from"], "crdt_buckets", {"buckets": BUCKETS, "digests": list(digests.items())})
+
+    async def _on_buckets(self, env: dict):
+        if not (payload := self._open(env)) or payload.get("buckets") != BUCKETS:
+            return
+        theirs = {int(b): d for b, d in payload.get("digests", [])[:BUCKETS]}
+        mine = await self._blocking(self.graph.bucket_digests, sorted({b // GROUP for b in theirs}))
+        if differ := [b for b, d in theirs.items() if b in mine and mine[b] != d]:
+            await self._push(env["from"], differ)
+            await self.p2p.send_encrypted(env["from"], "crdt_pull", {"buckets": differ})
+
+    async def _on_pull(self, env: dict):
+        if payload := self._open(env):
+            await self._push(env["from"], [int(b) for b in payload.get("buckets", [])[:BUCKETS]])
+
+    async def _push(self, peer: str, buckets: List[int]):
+        ops = _ops(await self._blocking(self.graph.bucket_relations, buckets))
+        for s in range(0, len(ops), self.chunk_ops):
+            await self.p2p.send_encrypted(peer, "crdt_ops", {"ops": ops[s:s+self.chunk_ops]})
\ No newline at end of file
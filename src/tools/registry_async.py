@@ -5,6 +5,7 @@ from ..internet.search import WebSearch
 from ..internet.fetch import fetch_text
 from ..internet.cache import WebCache
 from ..memory.vector_store import LiteVectorStore
+from ..memory.conversation_store import ConversationMemory
 from ..core.config import AppConfig
 import ast, operator as op
 # Note: CodeSandbox import is moved inside __init__ to support conditional registration
@@ -25,8 +26,8 @@ def _safe_eval(expr: str) -> float | int:
     return _eval(ast.parse(expr, mode="eval").body)
 
 class AsyncToolRegistry:
-    def __init__(self, kb: LiteVectorStore, cfg: AppConfig, peer_client: Optional[object] = None):
-        self.kb, self.cfg, self.peer_client = kb, cfg, peer_client
+    def __init__(self, kb: LiteVectorStore, cfg: AppConfig, peer_client: Optional[object] = None, mem: Optional[ConversationMemory] = None):
+        self.kb, self.cfg, self.peer_client, self.mem = kb, cfg, peer_client, mem
         self.cache = WebCache(cfg.paths.web_cache_db)
         self.searcher = WebSearch()
         self.tools: Dict[str, Callable[[Dict[str, Any]], asyncio.Future]] = {
@@ -37,6 +38,7 @@ class AsyncToolRegistry:
             "fetch_url": self._fetch_url if cfg.assistant.allow_web_search else self._blocked,
             "kb_add": self._kb_add,
             "kb_query": self._kb_query,
+            "history_search": self._history_search if mem else self._blocked,
             "ingest_url": self._ingest_url if cfg.assistant.allow_web_search else self._blocked,
         }
 
@@ -99,13 +101,33 @@ class AsyncToolRegistry:
         return text
 
     async def _kb_add(self, a):
-        text = str(a.get("text","")); source = str(a.get("source","tool"))
-        n = await asyncio.get_event_loop().run_in_executor(None, self.kb.add_document, text, source)
+        source = str(a.get("source","tool"))
+        tags = a.get("tags") or []
+        tags = [t.strip() for t in tags.split(",")] if isinstance(tags, str) else [str(t) for t in tags]
+        if isinstance(texts := a.get("texts"), list):
+            # Several documents at once: one batched encode pass and a single transaction
+            docs = [(str(t), source, tags) for t in texts]
+            n = await asyncio.get_event_loop().run_in_executor(None, self.kb.add_documents, docs)
+            return f"Added {n} chunks from {len(docs)} documents."
+        text = str(a.get("text",""))
+        n = await asyncio.get_event_loop().run_in_executor(None, lambda: self.kb.add_document(text, source, tags=tags))
         return f"Added {n} chunks."
 
     async def _kb_query(self, a):
-        q, k = str(a.get("query","")), int(a.get("k",3))
-        return await asyncio.get_event_loop().run_in_executor(None, self.kb.retrieve_context, q, k)
+        q, k, mode = str(a.get("query","")), int(a.get("k",3)), a.get("mode")
+        # Optional scope: source prefix, ISO time range, required tags (list or comma-separated)
+        tags = a.get("tags") or []
+        tags = [t.strip() for t in tags.split(",")] if isinstance(tags, str) else [str(t) for t in tags]
+        scope = {"source": a.get("source"), "since": a.get("since"), "until": a.get("until"), "tags": tags}
+        return await asyncio.get_event_loop().run_in_executor(None, lambda: self.kb.retrieve_context(q, k, mode=mode, **scope))
+
+    async def _history_search(self, a):
+        q, k = str(a.get("query","")), int(a.get("k",5))
+        scope = {"session_id": a.get("session_id"), "since": a.get("since"), "until": a.get("until")}
+        hits = await asyncio.get_event_loop().run_in_executor(None, lambda: self.mem.search(q, k, **scope))
+        if not hits:
+            return "No matching past conversations."
+        return "\n\n".join(f"[{h['ts'][:16]} | {h['session_id']}]\nUser: {h['user'][:400]}\nAssistant: {h['assistant'][:400]}" for h in hits)
 
     async def _ingest_url(self, a):
         url = str(a.get("url",""))
@@ -113,7 +135,8 @@ class AsyncToolRegistry:
         if not text:
             text = await self._fetch_url({"url": url})
             self.cache.put(url, text)
-        n = await asyncio.get_event_loop().run_in_executor(None, self.kb.add_document, text, url)
+        # Re-ingesting a page replaces its previous chunks instead of piling up stale copies
+        n = await asyncio.get_event_loop().run_in_executor(None, self.kb.replace_source, url, text)
         return f"Ingested {n} chunks from {url}"
 
     async def _blocked(self, _a):
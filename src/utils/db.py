@@ -6,4 +6,14 @@ def configure_sqlite(conn):
     cur.execute("PRAGMA temp_store=MEMORY;")
     cur.execute("PRAGMA mmap_size=30000000000;")
     cur.execute("PRAGMA busy_timeout=5000;")
-    conn.commit()
\ No newline at end of file
+    conn.commit()
+
+def ensure_columns(conn, table: str, columns: dict) -> list:
+    """Add any missing columns ({name: sql type}) to an existing table; returns the names added."""
+    cur = conn.cursor()
+    have = {r[1] for r in cur.execute(f"PRAGMA table_info({table})").fetchall()}
+    added = [name for name in columns if name not in have]
+    for name in added:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {name} {columns[name]}")
+    conn.commit()
+    return added
\ No newline at end of file